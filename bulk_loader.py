@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import hashlib
+
+from tqdm import tqdm
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from icd_catalog import iter_index_documents
+
+BULK_CHECKPOINT_DIR = './checkpoint/bulk_load/'
+
+# 单个bulk请求的上限，先到哪个按哪个切分
+BULK_MAX_CHUNK_BYTES = 5 * 1024 * 1024
+BULK_MAX_CHUNK_DOCS = 1000
+
+# 这些状态码的失败文档会重试
+BULK_RETRY_STATUS = {429, 502, 503, 504}
+
+
+class BulkLoadError(Exception):
+    pass
+
+
+def iter_index_actions(documents):
+    # documents: [(文档ID, 文档)]，返回(操作, 文档)
+    for document_id, record in documents:
+        yield {'index': {'_id': document_id}}, record
+
+
+def iter_delete_actions(document_ids):
+    for document_id in document_ids:
+        yield {'delete': {'_id': document_id}}, None
+
+
+def iter_bulk_chunks(
+    actions,
+    max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+    max_chunk_docs=BULK_MAX_CHUNK_DOCS
+):
+    # 把(操作, 文档)序列化成ndjson，按字节数和文档数切块，返回每块的行列表
+    chunk = []
+    chunk_bytes = 0
+    for action, source in actions:
+        lines = [json.dumps(action, ensure_ascii=False)]
+        if source is not None:
+            lines.append(json.dumps(source, ensure_ascii=False))
+        line_bytes = sum(len(line_.encode('utf-8')) + 1 for line_ in lines)
+
+        if len(chunk) > 0 and (chunk_bytes + line_bytes > max_chunk_bytes or len(chunk) >= max_chunk_docs):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+
+        chunk.append(lines)
+        chunk_bytes += line_bytes
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def get_chunk_digest(chunk):
+    sha1 = hashlib.sha1()
+    for lines in chunk:
+        for line_ in lines:
+            sha1.update(line_.encode('utf-8'))
+            sha1.update(b'\n')
+    return sha1.hexdigest()
+
+
+def scan(es_client, index, query, scroll='5m', size=1000):
+    # 与elasticsearch.helpers.scan相同的scroll遍历，不依赖elasticsearch包，es_standin也可以使用
+    response = es_client.search(index=index, body=dict(query, sort=['_doc']), scroll=scroll, size=size)
+    scroll_id = response.get('_scroll_id')
+    try:
+        while len(response['hits']['hits']) > 0:
+            for hit_ in response['hits']['hits']:
+                yield hit_
+            response = es_client.scroll(body={'scroll_id': scroll_id, 'scroll': scroll})
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id is not None:
+            es_client.clear_scroll(body={'scroll_id': [scroll_id]}, ignore=(404,))
+
+
+class BulkLoader(object):
+    # 流式bulk写入:
+    # 1. 按字节数/文档数切块，workers个线程并行发送
+    # 2. 写入期间关闭refresh、副本数设为0，结束后恢复并force merge
+    # 3. 写成功的块记在checkpoint里，失败后重新运行会跳过已写入的块
+
+    def __init__(
+        self,
+        es_client,
+        index_name,
+        workers=4,
+        max_chunk_bytes=BULK_MAX_CHUNK_BYTES,
+        max_chunk_docs=BULK_MAX_CHUNK_DOCS,
+        max_retries=3,
+        checkpoint_dir=BULK_CHECKPOINT_DIR,
+        force_merge=True
+    ):
+        self.es_client = es_client
+        self.index_name = index_name
+        self.workers = workers
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_chunk_docs = max_chunk_docs
+        self.max_retries = max_retries
+        self.force_merge = force_merge
+
+        self.checkpoint_path = os.path.join(checkpoint_dir, index_name + '.json')
+        self.done_chunks = set()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as f:
+                self.done_chunks = set(json.load(f)['done_chunks'])
+
+    def save_checkpoint(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'index_name': self.index_name, 'done_chunks': sorted(self.done_chunks)}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        self.done_chunks = set()
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def send_chunk(self, chunk):
+        # 返回写入成功的文档数；只重试BULK_RETRY_STATUS的失败文档，其他失败直接抛出
+        for retry_ in range(self.max_retries + 1):
+            body = ''.join(line_ + '\n' for lines in chunk for line_ in lines)
+            response = self.es_client.bulk(body=body, index=self.index_name)
+            if not response['errors']:
+                return len(chunk)
+
+            retry_chunk = []
+            for lines, item in zip(chunk, response['items']):
+                result = next(iter(item.values()))
+                if result.get('status', 200) in BULK_RETRY_STATUS:
+                    retry_chunk.append(lines)
+                elif 'error' in result:
+                    raise BulkLoadError('bulk item failed: {0}'.format(result['error']))
+
+            if len(retry_chunk) == 0:
+                return len(chunk)
+            chunk = retry_chunk
+            time.sleep(2 ** retry_)
+
+        raise BulkLoadError('bulk chunk still rejected after {0} retries'.format(self.max_retries))
+
+    def load_actions(self, actions, total=None, desc=None):
+        # 在途的块最多workers * 2个，数据不会全部堆在内存里
+        progress = tqdm(total=total, desc=desc, unit='doc')
+        pending = dict()
+        skipped = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in iter_bulk_chunks(actions, self.max_chunk_bytes, self.max_chunk_docs):
+                    chunk_digest = get_chunk_digest(chunk)
+                    if chunk_digest in self.done_chunks:
+                        skipped += len(chunk)
+                        progress.update(len(chunk))
+                        continue
+
+                    if len(pending) >= self.workers * 2:
+                        self._wait_pending(pending, progress)
+                    pending[executor.submit(self.send_chunk, chunk)] = chunk_digest
+
+                while len(pending) > 0:
+                    self._wait_pending(pending, progress)
+        except BaseException:
+            # 退出with时在途的块都已结束，其中写入成功的也记进checkpoint，恢复时不再重复发送
+            self._record_finished(pending)
+            raise
+        finally:
+            progress.close()
+            self.save_checkpoint()
+
+        if skipped > 0:
+            print('{0}: skipped {1} docs already loaded'.format(desc, skipped))
+
+    def _wait_pending(self, pending, progress):
+        # 同一批完成的块先全部记录成功的，再抛出其中第一个失败
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        error = None
+        for future_ in done:
+            chunk_digest = pending.pop(future_)
+            if future_.exception() is not None:
+                error = future_.exception() if error is None else error
+                continue
+            self.done_chunks.add(chunk_digest)
+            progress.update(future_.result())
+        if error is not None:
+            raise error
+
+    def _record_finished(self, pending):
+        for future_, chunk_digest in list(pending.items()):
+            if future_.done() and not future_.cancelled() and future_.exception() is None:
+                self.done_chunks.add(chunk_digest)
+                pending.pop(future_)
+
+    def get_index_settings(self):
+        settings = self.es_client.indices.get_settings(index=self.index_name)[self.index_name]['settings']['index']
+        return {
+            'refresh_interval': settings.get('refresh_interval', '1s'),
+            'number_of_replicas': settings.get('number_of_replicas', '1')
+        }
+
+    def get_indexed_ids(self):
+        ids = set()
+        for hit_ in scan(self.es_client, index=self.index_name, query={'_source': False}):
+            ids.add(hit_['_id'])
+        return ids
+
+    def load(self, phases):
+        # phases: [(阶段名, DataFrame)]，按顺序写入，各阶段之间相同的文档只写一次
+        original_settings = self.get_index_settings()
+        self.es_client.indices.put_settings(
+            index=self.index_name,
+            body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}})
+        try:
+            seen_ids = set()
+            for phase_name, index_df in phases:
+                self.load_actions(
+                    iter_index_actions(iter_index_documents(index_df, seen_ids)),
+                    total=len(index_df),
+                    desc=phase_name)
+        finally:
+            self.es_client.indices.put_settings(index=self.index_name, body={'index': original_settings})
+
+        self.es_client.indices.refresh(index=self.index_name)
+        if self.force_merge:
+            self.es_client.indices.forcemerge(index=self.index_name, max_num_segments=1)
+
+        # 全部写入成功，下次重新运行是新的一次写入
+        self.clear_checkpoint()
+
+    def sync(self, phases):
+        # 增量更新: 文档ID由内容决定，只写入索引里还没有的文档，删除不再出现的文档
+        indexed_ids = self.get_indexed_ids()
+
+        seen_ids = set()
+        new_documents = []
+        for _, index_df in phases:
+            for document_id, record in iter_index_documents(index_df, seen_ids):
+                if document_id not in indexed_ids:
+                    new_documents.append((document_id, record))
+        stale_ids = sorted(indexed_ids - seen_ids)
+
+        print('{0}: {1} docs to upsert, {2} docs to delete, {3} unchanged'.format(
+            self.index_name, len(new_documents), len(stale_ids), len(seen_ids) - len(new_documents)))
+
+        self.load_actions(iter_index_actions(new_documents), total=len(new_documents), desc='upsert')
+        self.load_actions(iter_delete_actions(stale_ids), total=len(stale_ids), desc='delete')
+
+        self.es_client.indices.refresh(index=self.index_name)
+        self.clear_checkpoint()
+
+        return len(new_documents), len(stale_ids)
@@ -0,0 +1,233 @@
+import os
+import numpy as np
+
+DENSE_MODEL_NAME = 'nghuyong/ernie-1.0'
+
+# IVF划分时k-means的迭代次数和训练样本数
+IVF_KMEANS_ITERS = 20
+IVF_KMEANS_SAMPLES = 50000
+
+
+class DenseEncoder(object):
+    # 用ERNIE编码文本: 最后一层隐状态按attention mask求平均，再做L2归一化
+
+    def __init__(
+        self,
+        model_name=DENSE_MODEL_NAME,
+        max_seq_length=40,
+        device=None
+    ):
+        import torch
+        import transformers
+
+        self.torch = torch
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+        self.model = transformers.AutoModel.from_pretrained(model_name)
+        self.max_seq_length = max_seq_length
+        self.device = ('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+
+        self.model.to(self.device)
+        self.model.eval()
+
+    def encode(self, texts, batch_size=256):
+        # 返回float16的[len(texts), hidden_size]矩阵
+        embeddings = []
+        with self.torch.no_grad():
+            for start in range(0, len(texts), batch_size):
+                inputs = self.tokenizer(
+                    list(texts[start:start + batch_size]),
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_seq_length,
+                    return_tensors='pt'
+                ).to(self.device)
+
+                hidden_states = self.model(**inputs).last_hidden_state
+                mask = inputs['attention_mask'].unsqueeze(-1).type(hidden_states.dtype)
+                pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                pooled = self.torch.nn.functional.normalize(pooled, dim=-1)
+
+                embeddings.append(pooled.cpu().numpy().astype(np.float16))
+
+        return np.concatenate(embeddings, axis=0)
+
+
+def kmeans(vectors, n_clusters, n_iters=IVF_KMEANS_ITERS, seed=0):
+    # 球面k-means(向量已归一化，用内积作相似度)，返回归一化后的中心
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iters):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster_id in range(n_clusters):
+            members = vectors[assignment == cluster_id]
+            if len(members) > 0:
+                centroids[cluster_id] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+    return centroids
+
+
+class DenseNameIndex(object):
+    # names与embeddings一一对应，embeddings为L2归一化后的float16矩阵，内积即余弦相似度
+    # n_lists > 0时建IVF划分: 名称按k-means分到n_lists个桶，查询只在最近的n_probe个桶里精确打分
+
+    def __init__(
+        self,
+        names,
+        embeddings,
+        n_lists=0,
+        n_probe=8,
+        chunk_size=4096,
+        query_chunk_size=256
+    ):
+        self.names = list(names)
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float16)
+        self.n_probe = n_probe
+        # 名称按chunk_size转成float32打分；暴力检索时一次打分query_chunk_size个query，
+        # 中间结果为[query_chunk_size, 名称数]的float32矩阵(256 x 4万约40MB)
+        self.chunk_size = chunk_size
+        self.query_chunk_size = query_chunk_size
+
+        self.n_lists = 0
+        self.centroids = None
+        self.assignment = None
+        self.list_ids = None
+        if n_lists > 0:
+            self.build_ivf(n_lists)
+
+    def __len__(self):
+        return len(self.names)
+
+    def build_ivf(self, n_lists, seed=0):
+        vectors = self.embeddings.astype(np.float32)
+        rng = np.random.RandomState(seed)
+        sample_ids = rng.choice(len(vectors), min(IVF_KMEANS_SAMPLES, len(vectors)), replace=False)
+        centroids = kmeans(vectors[sample_ids], min(n_lists, len(sample_ids)), seed=seed)
+
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.chunk_size):
+            assignment[start:start + self.chunk_size] = np.argmax(
+                vectors[start:start + self.chunk_size] @ centroids.T, axis=1)
+        self.set_ivf(n_lists, centroids, assignment)
+
+    def set_ivf(self, n_lists, centroids, assignment):
+        # n_lists为建IVF时要求的桶数，名称比桶少时实际的中心数会更少
+        self.n_lists = n_lists
+        self.centroids = centroids
+        self.assignment = assignment
+        self.list_ids = [np.flatnonzero(assignment == list_id) for list_id in range(len(centroids))]
+
+    def _top_k(self, scores, candidate_ids, top_k):
+        if len(candidate_ids) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(candidate_ids))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.names[candidate_ids[idx]], float(scores[idx])) for idx in top]
+
+    def search_many(self, query_embeddings, top_k=20):
+        # 返回每个query的[(名称, 相似度)]，按相似度降序
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if self.centroids is None:
+            return self._search_flat(query_embeddings, top_k)
+        return self._search_ivf(query_embeddings, top_k)
+
+    def _search_flat(self, query_embeddings, top_k):
+        all_ids = np.arange(len(self.names))
+        results = []
+        for start in range(0, len(query_embeddings), self.query_chunk_size):
+            query_chunk = query_embeddings[start:start + self.query_chunk_size]
+            scores = np.empty((len(query_chunk), len(self.names)), dtype=np.float32)
+            for name_start in range(0, len(self.names), self.chunk_size):
+                name_chunk = self.embeddings[name_start:name_start + self.chunk_size].astype(np.float32)
+                scores[:, name_start:name_start + self.chunk_size] = query_chunk @ name_chunk.T
+            for row_ in scores:
+                results.append(self._top_k(row_, all_ids, top_k))
+        return results
+
+    def _search_ivf(self, query_embeddings, top_k):
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe_lists = np.argsort(-(query_embeddings @ self.centroids.T), axis=1)[:, :n_probe]
+
+        results = []
+        for query_embedding, list_ids_ in zip(query_embeddings, probe_lists):
+            candidate_ids = np.concatenate([self.list_ids[list_id] for list_id in list_ids_])
+            scores = self.embeddings[candidate_ids].astype(np.float32) @ query_embedding
+            results.append(self._top_k(scores, candidate_ids, top_k))
+        return results
+
+    def search(self, query_embedding, top_k=20):
+        return self.search_many(np.asarray(query_embedding)[None, :], top_k)[0]
+
+    def save(self, index_path):
+        # 建过IVF时中心和每个名称所在的桶一起保存，加载时不用重新做k-means
+        arrays = {'names': np.array(self.names, dtype=object), 'embeddings': self.embeddings}
+        if self.centroids is not None:
+            arrays['ivf_n_lists'] = np.array(self.n_lists)
+            arrays['ivf_centroids'] = self.centroids
+            arrays['ivf_assignment'] = self.assignment
+
+        tmp_path = index_path + '.tmp' + str(os.getpid()) + '.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path, n_lists=0, n_probe=8):
+        # 保存的IVF桶数与n_lists相同时直接使用，否则重新划分(n_lists为0时不用IVF)
+        data = np.load(index_path, allow_pickle=True)
+        index = cls(data['names'].tolist(), data['embeddings'], n_probe=n_probe)
+        if n_lists > 0:
+            if 'ivf_n_lists' in data.files and int(data['ivf_n_lists']) == n_lists:
+                index.set_ivf(n_lists, data['ivf_centroids'], data['ivf_assignment'])
+            else:
+                index.build_ivf(n_lists)
+        return index
+
+
+class DenseRecall(object):
+    # 查询编码 + DenseNameIndex检索，返回标准词列表
+
+    def __init__(self, encoder, index):
+        self.encoder = encoder
+        self.index = index
+
+    def search_many(self, queries, top_k=20):
+        if len(queries) == 0:
+            return []
+        return self.index.search_many(self.encoder.encode(queries), top_k)
+
+    def search(self, _query, top_k=20):
+        return self.search_many([_query], top_k)[0]
+
+
+def build_dense_index(icd_catalog, encoder, index_path):
+    # ICD名称离线编码一次，以float16矩阵保存
+    names = sorted(icd_catalog.icd_name_set)
+    index = DenseNameIndex(names, encoder.encode(names))
+    index.save(index_path)
+    return index
+
+
+def load_or_build_dense_recall(icd_catalog, index_path, n_lists=0, n_probe=8, device=None):
+    encoder = DenseEncoder(device=device)
+    if os.path.exists(index_path):
+        index = DenseNameIndex.load(index_path, n_lists=n_lists, n_probe=n_probe)
+        saved_n_lists = int(np.load(index_path, allow_pickle=True).get('ivf_n_lists', 0))
+        if n_lists > 0 and saved_n_lists != n_lists:
+            index.save(index_path)
+    else:
+        index = build_dense_index(icd_catalog, encoder, index_path)
+        if n_lists > 0:
+            index.build_ivf(n_lists)
+            index.save(index_path)
+    return DenseRecall(encoder, index)
+
+
+if __name__ == '__main__':
+    # python dense_recall.py: 离线编码ICD名称
+    from icd_catalog import load_icd_catalog
+    from icd_catalog import get_dense_index_path
+
+    icd_catalog = load_icd_catalog()
+    dense_index_path = get_dense_index_path(icd_catalog.source_sha256)
+    index = build_dense_index(icd_catalog, DenseEncoder(), dense_index_path)
+    print('dense index: {0} names, {1}'.format(len(index), dense_index_path))
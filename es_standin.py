@@ -0,0 +1,471 @@
+import json
+import time
+import random
+import fnmatch
+import argparse
+import threading
+
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+
+from local_search import LocalSearchEngine
+
+# 进程内或本地HTTP的ES替身，只实现项目用到的部分:
+# 索引创建/查询/删除、别名、settings、bulk、match/match_all查询、msearch、scroll(一次返回全部)
+# 打分使用local_search的BM25，与ES默认的打分一致；latency用来模拟网络往返时间
+
+STANDIN_VERSION = '7.10.2'
+
+
+class StandInError(Exception):
+
+    def __init__(self, status, error_type, reason):
+        super(StandInError, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'error': {
+                'root_cause': [{'type': self.error_type, 'reason': self.reason}],
+                'type': self.error_type,
+                'reason': self.reason
+            },
+            'status': self.status
+        }
+
+
+def index_not_found(index_name):
+    return StandInError(404, 'index_not_found_exception', 'no such index [{0}]'.format(index_name))
+
+
+def filter_source(source, source_filter):
+    # _source: True/False或字段列表
+    if source_filter is False:
+        return {}
+    if source_filter is True:
+        return {'_source': source}
+    if isinstance(source_filter, str):
+        source_filter = [source_filter]
+    return {'_source': {key_: value_ for key_, value_ in source.items() if key_ in source_filter}}
+
+
+class InMemoryIndex(object):
+
+    def __init__(self, name, body=None):
+        self.name = name
+        self.body = dict() if body is None else body
+        self.docs = OrderedDict()
+        self.aliases = set()
+        self.settings = {'refresh_interval': '1s', 'number_of_replicas': '1', 'number_of_shards': '1'}
+        self.next_id = 0
+        # 按字段缓存的BM25引擎，文档变化后重建
+        self.engines = dict()
+
+    def put(self, doc_id, source):
+        if doc_id is None:
+            doc_id = 'standin{0}'.format(self.next_id)
+            self.next_id += 1
+        result = 'updated' if doc_id in self.docs else 'created'
+        self.docs[doc_id] = source
+        self.engines = dict()
+        return doc_id, result
+
+    def delete(self, doc_id):
+        if doc_id not in self.docs:
+            return 'not_found'
+        del self.docs[doc_id]
+        self.engines = dict()
+        return 'deleted'
+
+    def search(self, query, size):
+        # 返回[(_id, _score, _source)]和命中总数
+        if query is None or 'match_all' in query:
+            hits = [(doc_id, 1.0, source) for doc_id, source in self.docs.items()]
+            return hits[:size], len(hits)
+
+        if 'match' not in query:
+            raise StandInError(400, 'parsing_exception', 'unsupported query: {0}'.format(list(query)))
+
+        field, match = next(iter(query['match'].items()))
+        _query = match['query'] if isinstance(match, dict) else match
+
+        engine = self.engines.get(field)
+        if engine is None:
+            engine = LocalSearchEngine(
+                list(self.docs.values()), field=field, index_name=self.name, ids=list(self.docs.keys()))
+            self.engines[field] = engine
+
+        result = engine.search(str(_query), size)['hits']
+        return [(hit_['_id'], hit_['_score'], hit_['_source']) for hit_ in result['hits']], result['total']['value']
+
+
+class InMemoryIndicesClient(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def exists(self, index, **kwargs):
+        self.client.wait()
+        return len(self.client.resolve(index, allow_missing=True)) > 0
+
+    def create(self, index, body=None, **kwargs):
+        self.client.wait()
+        with self.client.lock:
+            if index in self.client.indices_:
+                raise StandInError(400, 'resource_already_exists_exception', 'index [{0}] already exists'.format(index))
+            self.client.indices_[index] = InMemoryIndex(index, body)
+        return {'acknowledged': True, 'shards_acknowledged': True, 'index': index}
+
+    def delete(self, index, **kwargs):
+        self.client.wait()
+        with self.client.lock:
+            for index_ in self.client.resolve(index):
+                del self.client.indices_[index_.name]
+        return {'acknowledged': True}
+
+    def get(self, index, **kwargs):
+        self.client.wait()
+        return OrderedDict(
+            (index_.name, {'aliases': {alias_: {} for alias_ in index_.aliases},
+                           'mappings': index_.body.get('mappings', {}),
+                           'settings': {'index': dict(index_.settings)}})
+            for index_ in self.client.resolve(index, allow_missing=True))
+
+    def exists_alias(self, name, **kwargs):
+        self.client.wait()
+        return any(name in index_.aliases for index_ in self.client.indices_.values())
+
+    def get_alias(self, name=None, index=None, **kwargs):
+        self.client.wait()
+        result = OrderedDict()
+        for index_ in self.client.indices_.values():
+            if name is not None and name not in index_.aliases:
+                continue
+            if index is not None and index_.name not in [i.name for i in self.client.resolve(index)]:
+                continue
+            result[index_.name] = {'aliases': {alias_: {} for alias_ in index_.aliases}}
+        if name is not None and len(result) == 0:
+            raise StandInError(404, 'aliases_not_found_exception', 'alias [{0}] missing'.format(name))
+        return result
+
+    def update_aliases(self, body, **kwargs):
+        self.client.wait()
+        # 同一个请求里的操作在锁内一起生效，读请求看不到中间状态
+        with self.client.lock:
+            for action in body['actions']:
+                (op, params), = action.items()
+                for index_ in self.client.resolve(params['index']):
+                    if op == 'add':
+                        index_.aliases.add(params['alias'])
+                    elif op == 'remove':
+                        index_.aliases.discard(params['alias'])
+        return {'acknowledged': True}
+
+    def get_settings(self, index, **kwargs):
+        self.client.wait()
+        return OrderedDict(
+            (index_.name, {'settings': {'index': dict(index_.settings)}}) for index_ in self.client.resolve(index))
+
+    def put_settings(self, index, body, **kwargs):
+        self.client.wait()
+        settings = body.get('index', body)
+        for index_ in self.client.resolve(index):
+            for key_, value_ in settings.items():
+                index_.settings[key_] = str(value_)
+        return {'acknowledged': True}
+
+    def refresh(self, index=None, **kwargs):
+        self.client.wait()
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def forcemerge(self, index=None, **kwargs):
+        self.client.wait()
+        return {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+
+class InMemoryElasticsearch(object):
+    # 与elasticsearch.Elasticsearch(7.x)调用方式相同的进程内替身
+    # latency/jitter: 每个请求额外等待latency + uniform(0, jitter)秒
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.indices_ = OrderedDict()
+        self.indices = InMemoryIndicesClient(self)
+        self.request_num = 0
+
+    def wait(self):
+        with self.lock:
+            self.request_num += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def resolve(self, index, allow_missing=False):
+        # 索引名、别名、通配符或逗号分隔的列表 -> [InMemoryIndex]
+        if index is None or index in ('_all', '*'):
+            return list(self.indices_.values())
+
+        resolved = OrderedDict()
+        for name_ in (index.split(',') if isinstance(index, str) else index):
+            matched = [
+                index_ for index_ in self.indices_.values()
+                if fnmatch.fnmatchcase(index_.name, name_) or name_ in index_.aliases
+            ]
+            if len(matched) == 0 and not allow_missing and '*' not in name_:
+                raise index_not_found(name_)
+            for index_ in matched:
+                resolved[index_.name] = index_
+        return list(resolved.values())
+
+    def info(self, **kwargs):
+        return {'name': 'standin', 'cluster_name': 'standin', 'version': {'number': STANDIN_VERSION}}
+
+    def ping(self, **kwargs):
+        return True
+
+    def bulk(self, body, index=None, **kwargs):
+        self.wait()
+        if isinstance(body, (bytes, str)):
+            lines = [json.loads(line_) for line_ in (body.decode('utf-8') if isinstance(body, bytes) else body).splitlines() if line_.strip()]
+        else:
+            lines = list(body)
+
+        started = time.time()
+        items = []
+        errors = False
+        with self.lock:
+            position = 0
+            while position < len(lines):
+                (op, params), = lines[position].items()
+                position += 1
+                source = None
+                if op in ('index', 'create', 'update'):
+                    source = lines[position]
+                    position += 1
+
+                index_name = params.get('_index', index)
+                try:
+                    index_ = self._get_or_create_index(index_name)
+                    if op == 'delete':
+                        result = index_.delete(params['_id'])
+                        doc_id = params['_id']
+                        status = 404 if result == 'not_found' else 200
+                    else:
+                        if op == 'update':
+                            source = dict(index_.docs.get(params['_id'], {}), **source.get('doc', {}))
+                        doc_id, result = index_.put(params.get('_id'), source)
+                        status = 201 if result == 'created' else 200
+                    items.append({op: {'_index': index_.name, '_id': doc_id, 'result': result, 'status': status}})
+                except StandInError as e:
+                    errors = True
+                    items.append({op: {'_index': index_name, 'status': e.status, 'error': e.to_dict()['error']}})
+
+        return {'took': int((time.time() - started) * 1000), 'errors': errors, 'items': items}
+
+    def _get_or_create_index(self, index_name):
+        # 与ES默认行为一致，bulk写入不存在的索引时自动创建
+        resolved = self.resolve(index_name, allow_missing=True)
+        if len(resolved) > 0:
+            return resolved[0]
+        index_ = InMemoryIndex(index_name)
+        self.indices_[index_name] = index_
+        return index_
+
+    def _search(self, index, body, size):
+        body = dict() if body is None else body
+        size = body.get('size', 10) if size is None else size
+        with self.lock:
+            indices = self.resolve(index)
+            hits = []
+            total = 0
+            for index_ in indices:
+                index_hits, index_total = index_.search(body.get('query'), size)
+                total += index_total
+                hits.extend((index_.name, doc_id, score_, source) for doc_id, score_, source in index_hits)
+
+        hits.sort(key=lambda x: -x[2])
+        hits = hits[:size]
+        source_filter = body.get('_source', True)
+        return {
+            'took': 0,
+            'timed_out': False,
+            '_shards': {'total': len(indices), 'successful': len(indices), 'skipped': 0, 'failed': 0},
+            'hits': {
+                'total': {'value': total, 'relation': 'eq'},
+                'max_score': hits[0][2] if len(hits) > 0 else None,
+                'hits': [
+                    dict({'_index': index_name, '_type': '_doc', '_id': doc_id, '_score': score_},
+                         **filter_source(source, source_filter))
+                    for index_name, doc_id, score_, source in hits
+                ]
+            }
+        }
+
+    def search(self, index=None, body=None, size=None, scroll=None, **kwargs):
+        self.wait()
+        if scroll is not None:
+            # scroll一次返回全部结果，后续scroll请求返回空
+            with self.lock:
+                size = sum(len(index_.docs) for index_ in self.resolve(index))
+            result = self._search(index, body, size)
+            result['_scroll_id'] = 'standin-scroll'
+            return result
+        return self._search(index, body, size)
+
+    def scroll(self, *args, **kwargs):
+        self.wait()
+        return {'_scroll_id': 'standin-scroll', 'hits': {'total': {'value': 0, 'relation': 'eq'}, 'hits': []}}
+
+    def clear_scroll(self, *args, **kwargs):
+        return {'succeeded': True, 'num_freed': 1}
+
+    def msearch(self, body, index=None, **kwargs):
+        self.wait()
+        if isinstance(body, (bytes, str)):
+            body = [json.loads(line_) for line_ in (body.decode('utf-8') if isinstance(body, bytes) else body).splitlines() if line_.strip()]
+
+        responses = []
+        for header, search_body in zip(body[0::2], body[1::2]):
+            try:
+                response = self._search(header.get('index', index), search_body, search_body.get('size'))
+                response['status'] = 200
+            except StandInError as e:
+                response = e.to_dict()
+            responses.append(response)
+        return {'took': 0, 'responses': responses}
+
+    def close(self):
+        pass
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    # ES REST接口的最小子集，路径与ES相同，elasticsearch客户端可以直接连接
+    client = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, result=None):
+        payload = b'' if result is None else json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length > 0 else ''
+
+    def _json_body(self):
+        raw_body = self._read_body()
+        return json.loads(raw_body) if raw_body.strip() else None
+
+    def _dispatch(self):
+        url = urlparse(self.path)
+        params = {key_: values_[-1] for key_, values_ in parse_qs(url.query).items()}
+        parts = [part_ for part_ in url.path.split('/') if part_ != '']
+        method = self.command
+        client = self.client
+
+        if len(parts) == 0:
+            return 200, client.info()
+        if parts[-1] == '_bulk':
+            return 200, client.bulk(self._read_body(), index=parts[0] if len(parts) == 2 else None)
+        if parts[-1] == '_msearch':
+            return 200, client.msearch(self._read_body(), index=parts[0] if len(parts) == 2 else None)
+        if parts[0] == '_search' and len(parts) >= 2 and parts[1] == 'scroll':
+            self._read_body()
+            if method == 'DELETE':
+                return 200, client.clear_scroll()
+            return 200, client.scroll()
+        if parts[-1] == '_search':
+            body = self._json_body()
+            size = int(params['size']) if 'size' in params else None
+            return 200, client.search(
+                index=parts[0] if len(parts) == 2 else None, body=body, size=size, scroll=params.get('scroll'))
+        if parts[0] == '_aliases':
+            return 200, client.indices.update_aliases(self._json_body())
+        if parts[0] == '_alias':
+            if method == 'HEAD':
+                return (200 if client.indices.exists_alias(parts[1]) else 404), None
+            return 200, client.indices.get_alias(name=parts[1] if len(parts) > 1 else None)
+        if len(parts) >= 2 and parts[1] == '_alias':
+            if method == 'HEAD':
+                exists = any(parts[2] in index_.aliases for index_ in client.resolve(parts[0], allow_missing=True))
+                return (200 if exists else 404), None
+            return 200, client.indices.get_alias(name=parts[2] if len(parts) > 2 else None, index=parts[0])
+        if len(parts) == 2 and parts[1] == '_settings':
+            if method == 'PUT':
+                return 200, client.indices.put_settings(parts[0], self._json_body())
+            return 200, client.indices.get_settings(parts[0])
+        if len(parts) == 2 and parts[1] == '_refresh':
+            return 200, client.indices.refresh(parts[0])
+        if len(parts) == 2 and parts[1] == '_forcemerge':
+            return 200, client.indices.forcemerge(parts[0])
+        if len(parts) == 1:
+            if method == 'HEAD':
+                return (200 if client.indices.exists(parts[0]) else 404), None
+            if method == 'PUT':
+                return 200, client.indices.create(parts[0], self._json_body())
+            if method == 'DELETE':
+                return 200, client.indices.delete(parts[0])
+            if method == 'GET':
+                result = client.indices.get(parts[0])
+                if len(result) == 0:
+                    raise index_not_found(parts[0])
+                return 200, result
+
+        raise StandInError(400, 'illegal_argument_exception', 'unsupported request: {0} {1}'.format(method, url.path))
+
+    def _handle(self):
+        try:
+            status, result = self._dispatch()
+        except StandInError as e:
+            status, result = e.status, e.to_dict()
+        self._send(status, result)
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+    do_HEAD = _handle
+    do_DELETE = _handle
+
+
+def start_standin_server(host='127.0.0.1', port=9200, client=None, latency=0.0, jitter=0.0):
+    # 在后台线程启动HTTP替身，返回(server, client)；port=0时由系统分配端口，见server.server_address
+    client = InMemoryElasticsearch(latency=latency, jitter=jitter) if client is None else client
+    handler = type('BoundStandInRequestHandler', (StandInRequestHandler,), {'client': client})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, client
+
+
+if __name__ == '__main__':
+    # python es_standin.py --port 9200 --latency 0.005
+    # 然后ES_HOST=127.0.0.1 ES_PORT=9200 python es_index.py / predict.py
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    args = parser.parse_args()
+
+    client = InMemoryElasticsearch(latency=args.latency, jitter=args.jitter)
+    handler = type('BoundStandInRequestHandler', (StandInRequestHandler,), {'client': client})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print('es stand-in listening on {0}:{1}'.format(args.host, args.port))
+    server.serve_forever()
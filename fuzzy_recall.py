@@ -0,0 +1,118 @@
+import numpy as np
+
+# 名称每FUZZY_LENGTH_PER_EDIT个字符允许1处编辑，短名称只有很少的字符，1处编辑就能匹配大量无关查询
+FUZZY_LENGTH_PER_EDIT = 4
+
+
+def deletion_variants(string, max_distance):
+    # string删掉至多max_distance个字符得到的所有字符串(包括自身)
+    variants = {string}
+    frontier = {string}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for variant_ in frontier:
+            for idx in range(len(variant_)):
+                next_frontier.add(variant_[:idx] + variant_[idx + 1:])
+        variants.update(next_frontier)
+        frontier = next_frontier
+    return variants
+
+
+def substring_edit_distance(keyword, text, max_distance):
+    # keyword与text任意子串之间的最小编辑距离(Sellers算法，子串起止位置不计代价)
+    # 超过max_distance时提前返回max_distance + 1
+    previous_row = [0] * (len(text) + 1)
+    for idx, keyword_ch in enumerate(keyword, 1):
+        current_row = [idx]
+        for jdx, text_ch in enumerate(text, 1):
+            current_row.append(min(
+                previous_row[jdx - 1] + (keyword_ch != text_ch),
+                previous_row[jdx] + 1,
+                current_row[jdx - 1] + 1
+            ))
+        if min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+    return min(previous_row)
+
+
+class FuzzyNameIndex(object):
+    # 删除邻域索引: 对每个名称预先生成删掉至多max_distance个字符的所有变体，
+    # 查询时对query的子串同样生成删除变体，两边有相同变体的名称才作为候选，再用编辑距离校验
+    # 变体只存64位hash，排好序放在numpy数组里用searchsorted查找，hash冲突在校验阶段过滤
+    # 每个名称允许的编辑距离为min(max_distance, len(名称) // length_per_edit)，
+    # 默认只索引至少允许1处编辑的名称，更短的名称由AC自动机精确匹配
+
+    def __init__(
+        self,
+        words,
+        max_distance=1,
+        min_length=None,
+        length_per_edit=FUZZY_LENGTH_PER_EDIT
+    ):
+        self.max_distance = max_distance
+        self.length_per_edit = length_per_edit
+        self.min_length = length_per_edit if min_length is None else min_length
+
+        self.words = sorted(word for word in set(words) if len(word) >= self.min_length)
+        self.word_max_distances = [self.get_word_max_distance(word) for word in self.words]
+        self.max_word_length = max((len(word) for word in self.words), default=0)
+
+        variant_hashes = []
+        variant_word_ids = []
+        for word_id, word in enumerate(self.words):
+            for variant_ in deletion_variants(word, self.word_max_distances[word_id]):
+                variant_hashes.append(hash(variant_))
+                variant_word_ids.append(word_id)
+
+        variant_hashes = np.array(variant_hashes, dtype=np.int64)
+        order = np.argsort(variant_hashes, kind='stable')
+        self.variant_hashes = variant_hashes[order]
+        self.variant_word_ids = np.array(variant_word_ids, dtype=np.int32)[order]
+
+    def get_word_max_distance(self, word):
+        return min(self.max_distance, len(word) // self.length_per_edit)
+
+    def _query_variant_hashes(self, text, max_distance):
+        min_length = max(self.min_length - max_distance, 1)
+        max_length = min(self.max_word_length + max_distance, len(text))
+
+        variants = set()
+        for start in range(len(text)):
+            for end in range(start + min_length, min(start + max_length, len(text)) + 1):
+                variants.update(deletion_variants(text[start:end], max_distance))
+        return np.array([hash(variant_) for variant_ in variants], dtype=np.int64)
+
+    def search(self, text, max_distance=None, max_results=20):
+        # 返回[(名称, 编辑距离)]，按编辑距离升序、名称长度降序，最多max_results个
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        if not text or len(self.words) == 0:
+            return []
+
+        query_hashes = self._query_variant_hashes(text, max_distance)
+        if len(query_hashes) == 0:
+            return []
+
+        left = np.searchsorted(self.variant_hashes, query_hashes, side='left')
+        right = np.searchsorted(self.variant_hashes, query_hashes, side='right')
+        hit = right > left
+        if not hit.any():
+            return []
+
+        candidate_ids = set()
+        for left_, right_ in zip(left[hit], right[hit]):
+            candidate_ids.update(self.variant_word_ids[left_:right_].tolist())
+
+        results = []
+        for word_id in candidate_ids:
+            word = self.words[word_id]
+            word_max_distance = min(max_distance, self.word_max_distances[word_id])
+            distance = substring_edit_distance(word, text, word_max_distance)
+            if distance <= word_max_distance:
+                results.append((word, distance))
+
+        results.sort(key=lambda x: (x[1], -len(x[0]), x[0]))
+        if max_results is not None:
+            results = results[:max_results]
+        return results
@@ -0,0 +1,247 @@
+import os
+import re
+import pickle
+import hashlib
+import pandas as pd
+
+from normalizer import clean_many
+
+ICD_XLSX_PATH = './国际疾病分类 ICD-10 北京临床版v601.xlsx'
+ICD_CATALOG_DIR = './checkpoint/icd_catalog/'
+
+# 编译结果的格式版本，字段或处理逻辑变化时加一，旧文件会自动重新编译
+CATALOG_FORMAT_VERSION = 1
+
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block_ in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block_)
+    return sha256.hexdigest()
+
+
+def read_icd_xlsx(xlsx_path=ICD_XLSX_PATH):
+    icd_df = pd.read_excel(
+        xlsx_path,
+        header=None,
+        names=['icd_code', 'name']
+    )
+
+    icd_df['name'] = icd_df['name'].apply(lambda x: re.sub('"', '', x))
+    icd_df = icd_df.rename(columns={'name': 'entity_name'})
+    icd_df['icd_code_length'] = icd_df['icd_code'].apply(lambda x: len(x))
+    icd_df.sort_values('icd_code_length', ascending = False, inplace=True)
+    icd_df = icd_df.groupby('entity_name').head(1)
+    icd_df = icd_df[icd_df['entity_name'] != 'N']
+
+    return icd_df
+
+
+class IcdCatalog(object):
+
+    def __init__(
+        self,
+        icd_codes,
+        entity_names,
+        surface_names,
+        source_sha256
+    ):
+        self.icd_codes = icd_codes
+        self.entity_names = entity_names
+        # clean之后的名称，与entity_names一一对应
+        self.surface_names = surface_names
+        self.source_sha256 = source_sha256
+
+        self.name2icd_dict = dict()
+        for icd_code, entity_name in zip(self.icd_codes, self.entity_names):
+            self.name2icd_dict[entity_name] = icd_code
+
+        self.icd_name_set = set(self.entity_names)
+
+    def __len__(self):
+        return len(self.entity_names)
+
+    def to_dataframe(self):
+        icd_df = pd.DataFrame({
+            'icd_code': self.icd_codes,
+            'entity_name': self.entity_names
+        })
+        icd_df['icd_code_length'] = icd_df['icd_code'].apply(lambda x: len(x))
+        return icd_df
+
+    def save(self, catalog_path):
+        catalog = {
+            'format_version': CATALOG_FORMAT_VERSION,
+            'source_sha256': self.source_sha256,
+            'icd_codes': self.icd_codes,
+            'entity_names': self.entity_names,
+            'surface_names': self.surface_names
+        }
+
+        # 先写临时文件再替换，多个进程同时编译时不会读到半个文件
+        tmp_path = catalog_path + '.tmp' + str(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, catalog_path)
+
+    @classmethod
+    def load(cls, catalog_path):
+        with open(catalog_path, 'rb') as f:
+            catalog = pickle.load(f)
+
+        if catalog.get('format_version') != CATALOG_FORMAT_VERSION:
+            raise ValueError('icd catalog format version mismatch: ' + catalog_path)
+
+        return cls(
+            catalog['icd_codes'],
+            catalog['entity_names'],
+            catalog['surface_names'],
+            catalog['source_sha256']
+        )
+
+
+def get_catalog_path(source_sha256, catalog_dir=ICD_CATALOG_DIR):
+    return os.path.join(catalog_dir, 'icd_catalog_v{0}_{1}.pkl'.format(CATALOG_FORMAT_VERSION, source_sha256[:16]))
+
+
+def get_trie_snapshot_path(source_sha256, catalog_dir=ICD_CATALOG_DIR):
+    # 由ICD名称构建的AC自动机快照，和目录放在一起
+    return os.path.join(catalog_dir, 'icd_trie_{0}.bin'.format(source_sha256[:16]))
+
+
+def get_dense_index_path(source_sha256, catalog_dir=ICD_CATALOG_DIR):
+    # ICD名称的ERNIE向量(float16)，由dense_recall.py离线生成
+    return os.path.join(catalog_dir, 'icd_dense_{0}.npz'.format(source_sha256[:16]))
+
+
+def compile_icd_catalog(xlsx_path=ICD_XLSX_PATH, catalog_dir=ICD_CATALOG_DIR, workers=None):
+    source_sha256 = file_sha256(xlsx_path)
+    icd_df = read_icd_xlsx(xlsx_path)
+
+    entity_names = icd_df['entity_name'].to_list()
+    catalog = IcdCatalog(
+        icd_df['icd_code'].to_list(),
+        entity_names,
+        clean_many(entity_names, workers=workers),
+        source_sha256
+    )
+
+    os.makedirs(catalog_dir, exist_ok=True)
+    catalog.save(get_catalog_path(source_sha256, catalog_dir))
+
+    return catalog
+
+
+def load_icd_catalog(xlsx_path=ICD_XLSX_PATH, catalog_dir=ICD_CATALOG_DIR):
+    # 以xlsx的sha256为key，xlsx变化后自动重新编译
+    catalog_path = get_catalog_path(file_sha256(xlsx_path), catalog_dir)
+    if os.path.exists(catalog_path):
+        try:
+            return IcdCatalog.load(catalog_path)
+        except (ValueError, KeyError, EOFError, pickle.UnpicklingError):
+            pass
+
+    return compile_icd_catalog(xlsx_path, catalog_dir)
+
+
+def read_train_data(train_path='./train.txt'):
+    return pd.read_csv(
+        train_path,
+        sep='\t',
+        header=None,
+        names=['text', 'normalized_result'])
+
+
+def get_local_index_version(backend, icd_catalog, train_path='./train.txt'):
+    # 进程内召回没有ES别名，用后端名 + ICD目录和train.txt的内容作为召回缓存的版本号
+    return '{0}_{1}_{2}'.format(backend, icd_catalog.source_sha256[:16], file_sha256(train_path)[:16])
+
+
+def build_index_dataframes(icd_catalog, train_data_df, workers=None):
+    # 召回索引里的四类文档，按原来写入ES的顺序返回[(名称, DataFrame)]
+    # 1. ICD名称本身
+    icd_df = icd_catalog.to_dataframe()
+    icd_df['surface_name'] = icd_df['entity_name']
+
+    # 2. 训练集原文 -> 训练集中出现在ICD目录里的标准词
+    name2icd_dict = icd_catalog.name2icd_dict
+    history_list = []
+    for text_, normalized_result_ in zip(train_data_df['text'],
+                                         train_data_df['normalized_result']):
+        for term_ in normalized_result_.split('##'):
+            if re.sub('"', '', term_) in name2icd_dict:
+                history_list.append([text_, re.sub('"', '', term_), name2icd_dict[re.sub('"', '', term_)]])
+
+    train_history_df = pd.DataFrame(history_list, columns=['surface_name', 'entity_name', 'icd_code'])
+
+    # 3. clean之后与原名不同的ICD名称
+    icd_df2 = icd_catalog.to_dataframe()
+    icd_df2['surface_name'] = icd_catalog.surface_names
+    icd_df2 = icd_df2[icd_df2['surface_name'] != icd_df2['entity_name']].loc[:,['icd_code', 'entity_name', 'surface_name']]
+
+    # 4. 训练集中不在ICD目录里的标准词，clean后的原文和标准词都作为surface_name
+    extra_list = []
+    for text_, normalized_result_ in zip(train_data_df['text'],
+                                         train_data_df['normalized_result']):
+        for term_ in normalized_result_.split('##'):
+            if term_ not in name2icd_dict:
+                if term_ == 'O':
+                    continue
+                extra_list.append([text_, term_, '0'])
+                extra_list.append([term_, term_, '0'])
+
+    train_extra_df = pd.DataFrame(extra_list, columns=['surface_name', 'entity_name', 'icd_code'])
+    train_extra_df['surface_name'] = clean_many(train_extra_df['surface_name'], workers=workers)
+
+    return [
+        ('icd', icd_df),
+        ('train_history', train_history_df),
+        ('icd_cleaned', icd_df2),
+        ('train_extra', train_extra_df)
+    ]
+
+
+def get_document_id(record):
+    # 由文档内容得到的ID，重复写入同一文档时覆盖而不是新增
+    content = '\t'.join(str(record[field_]) for field_ in ('surface_name', 'entity_name', 'icd_code'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def iter_index_documents(index_df, seen_ids=None):
+    # 返回(文档ID, 文档)，seen_ids中已有的ID跳过，用来去掉各阶段之间的重复文档
+    seen_ids = set() if seen_ids is None else seen_ids
+    for record in index_df.astype(object).fillna('').to_dict('records'):
+        document_id = get_document_id(record)
+        if document_id in seen_ids:
+            continue
+        seen_ids.add(document_id)
+        yield document_id, record
+
+
+def build_index_records(icd_catalog, train_data_df, workers=None):
+    records = []
+    seen_ids = set()
+    for _, index_df in build_index_dataframes(icd_catalog, train_data_df, workers=workers):
+        records.extend(record for _, record in iter_index_documents(index_df, seen_ids))
+    return records
+
+
+def build_catalog_search_engine(engine_class, backend, train_path='./train.txt', workers=None, **kwargs):
+    # 进程内召回后端(local_search、tfidf_recall)共用: 使用与es_index.py写入ES相同的文档建索引，
+    # 召回缓存的版本号由后端名、ICD目录和train.txt决定
+    icd_catalog = load_icd_catalog()
+    records = build_index_records(icd_catalog, read_train_data(train_path), workers=workers)
+    return engine_class(records, index_name=get_local_index_version(backend, icd_catalog, train_path), **kwargs)
+
+
+if __name__ == '__main__':
+    # python icd_catalog.py: 一次性编译ICD目录和AC自动机快照
+    from trie import load_or_build_trie
+
+    icd_catalog = compile_icd_catalog()
+    print('icd catalog: {0} names, sha256 {1}'.format(len(icd_catalog), icd_catalog.source_sha256))
+
+    trie_snapshot_path = get_trie_snapshot_path(icd_catalog.source_sha256)
+    load_or_build_trie(icd_catalog.icd_name_set, trie_snapshot_path)
+    print('trie snapshot: {0}'.format(trie_snapshot_path))
@@ -0,0 +1,75 @@
+import re
+import time
+
+# 每个别名保留的历史版本数(包括当前版本)，用于回滚
+INDEX_KEEP_VERSIONS = 3
+
+
+def get_versioned_index_name(alias):
+    # 版本号用时间戳，按名称排序即按创建时间排序
+    return '{0}_{1}'.format(alias, time.strftime('%Y%m%d%H%M%S'))
+
+
+def get_index_versions(es_client, alias):
+    # 该别名的所有版本索引，按创建时间升序
+    # 通配符也会匹配到别名前缀相同的其他索引(比如icd_diagnose_test_20210601)，只保留get_versioned_index_name生成的名称
+    version_pattern = re.compile(re.escape(alias) + '_[0-9]{14}$')
+    return sorted(
+        index_name for index_name in es_client.indices.get(index=alias + '_*').keys()
+        if version_pattern.match(index_name))
+
+
+def get_alias_index(es_client, alias):
+    # 别名当前指向的索引，别名不存在时返回None
+    if not es_client.indices.exists_alias(name=alias):
+        return None
+    return sorted(es_client.indices.get_alias(name=alias).keys())[-1]
+
+
+def warm_up_index(es_client, index_name, queries, size=1000):
+    # 切换前用样例query预热新索引(加载词典、填充缓存)，返回有结果的query数
+    from search_engine import get_match_dsl
+
+    hit_num = 0
+    for _query in queries:
+        result = es_client.search(index=index_name, body=get_match_dsl(_query), size=size)
+        if len(result['hits']['hits']) > 0:
+            hit_num += 1
+    return hit_num
+
+
+def swap_alias(es_client, alias, index_name):
+    # 在一个update_aliases请求里移除旧指向、添加新指向，读请求不会看到中间状态
+    actions = []
+    old_index = get_alias_index(es_client, alias)
+    if old_index is not None:
+        actions.append({'remove': {'index': '*', 'alias': alias}})
+    actions.append({'add': {'index': index_name, 'alias': alias}})
+    es_client.indices.update_aliases(body={'actions': actions})
+    return old_index
+
+
+def rollback_alias(es_client, alias):
+    # 别名切回当前版本之前的一个版本，返回切换后的索引
+    current_index = get_alias_index(es_client, alias)
+    versions = get_index_versions(es_client, alias)
+    if current_index not in versions or versions.index(current_index) == 0:
+        raise ValueError('no previous version to roll back to: ' + str(current_index))
+
+    previous_index = versions[versions.index(current_index) - 1]
+    swap_alias(es_client, alias, previous_index)
+    return previous_index
+
+
+def delete_old_versions(es_client, alias, keep=INDEX_KEEP_VERSIONS):
+    # 删除最旧的版本，当前指向的索引和之前的keep - 1个版本保留
+    current_index = get_alias_index(es_client, alias)
+    versions = get_index_versions(es_client, alias)
+    if current_index in versions:
+        versions = versions[:versions.index(current_index) + 1]
+
+    deleted = versions[:-keep] if keep > 0 else versions
+    for index_name in deleted:
+        if index_name != current_index:
+            es_client.indices.delete(index=index_name)
+    return deleted
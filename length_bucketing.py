@@ -0,0 +1,166 @@
+import time
+import argparse
+import numpy as np
+
+# 按长度分桶时每个桶包含的batch数: 桶内按长度排序后再切batch，桶越大每个batch内长度越接近，随机性越小
+BUCKET_BATCH_NUM = 50
+
+# 需要按batch内最长样本截断的特征，其他特征(label_ids等)原样堆叠
+PADDED_COLS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+
+def get_lengths(dataset):
+    # 每个样本的实际长度(attention_mask中1的个数)
+    arrays = getattr(dataset, 'arrays', None)
+    if arrays is not None and 'attention_mask' in arrays:
+        return np.asarray(arrays['attention_mask'][dataset.indices].sum(axis=1))
+    return np.array([int(np.sum(row_['attention_mask'])) for row_ in dataset.dataset])
+
+
+class LengthBucketBatchSampler(object):
+    # 打乱后每batch_size * bucket_batch_num个样本为一个桶，桶内按长度排序切batch，最后打乱batch顺序
+    # 每个batch内长度相近，配合dynamic_padding_collate_fn只补齐到batch内最长的样本
+
+    def __init__(
+        self,
+        lengths,
+        batch_size,
+        shuffle=True,
+        bucket_batch_num=BUCKET_BATCH_NUM,
+        drop_last=False,
+        seed=None
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = batch_size * bucket_batch_num
+        self.drop_last = drop_last
+        self.random = np.random.RandomState(seed)
+
+    def __iter__(self):
+        indices = self.random.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')]
+            for batch_start in range(0, len(bucket), self.batch_size):
+                batch = bucket[batch_start:batch_start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    continue
+                batches.append(batch.tolist())
+
+        if self.shuffle:
+            self.random.shuffle(batches)
+
+        return iter(batches)
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(
+                min(self.bucket_size, len(self.lengths) - start) // self.batch_size
+                for start in range(0, len(self.lengths), self.bucket_size))
+        return sum(
+            -(-min(self.bucket_size, len(self.lengths) - start) // self.batch_size)
+            for start in range(0, len(self.lengths), self.bucket_size))
+
+
+def pad_batch(batch):
+    # 样本已经补齐到max_seq_len且padding在右侧，截到batch内最长的实际长度即可
+    max_length = max(int(np.sum(row_['attention_mask'])) for row_ in batch)
+    features = dict()
+    for col in batch[0]:
+        values = np.stack([np.asarray(row_[col], dtype=np.int64) for row_ in batch])
+        if col in PADDED_COLS:
+            values = values[:, :max_length]
+        features[col] = values
+    return features
+
+
+def dynamic_padding_collate_fn(batch):
+    import torch
+
+    return {col: torch.from_numpy(np.ascontiguousarray(values)) for col, values in pad_batch(batch).items()}
+
+
+def get_padding_stats(lengths, batches, max_seq_len):
+    # 返回(固定长度时的token数, 动态padding时的token数, 实际token数)
+    lengths = np.asarray(lengths)
+    fixed_tokens = len(lengths) * max_seq_len
+    dynamic_tokens = sum(int(lengths[batch].max()) * len(batch) for batch in batches)
+    return fixed_tokens, dynamic_tokens, int(lengths.sum())
+
+
+def report_padding_throughput(module, dataset, batch_size=32, max_batches=20, device='cpu'):
+    # 同样的样本分别按固定长度和按长度分桶 + 动态padding做前向+反向，打印每秒样本数
+    import torch
+
+    from torch.utils.data import DataLoader
+    from torch.utils.data.dataloader import default_collate
+
+    def fixed_collate_fn(batch):
+        return {col: default_collate([torch.as_tensor(row_[col]) for row_ in batch]) for col in batch[0]}
+
+    lengths = get_lengths(dataset)
+    sampler = LengthBucketBatchSampler(lengths, batch_size, seed=0)
+    bucket_batches = list(iter(sampler))[:max_batches]
+    sample_ids = [idx for batch in bucket_batches for idx in batch]
+    fixed_batches = [sample_ids[start:start + batch_size] for start in range(0, len(sample_ids), batch_size)]
+
+    module.to(device)
+    module.train()
+
+    results = dict()
+    for mode_, batches, collate_fn in [
+        ('fixed', fixed_batches, fixed_collate_fn),
+        ('bucketed', bucket_batches, dynamic_padding_collate_fn)
+    ]:
+        generator = DataLoader(dataset, batch_sampler=batches, collate_fn=collate_fn)
+        example_num = 0
+        token_num = 0
+        start_time = time.time()
+        for inputs in generator:
+            inputs.pop('label_ids', None)
+            inputs = {col: values.to(device) for col, values in inputs.items()}
+            outputs = module(**inputs)
+            outputs = outputs if isinstance(outputs, torch.Tensor) else outputs[0]
+            outputs.float().sum().backward()
+            module.zero_grad()
+
+            example_num += inputs['input_ids'].shape[0]
+            token_num += inputs['input_ids'].numel()
+        elapsed = time.time() - start_time
+        results[mode_] = (example_num / elapsed, token_num)
+        print('{0:>8s}: {1:8.1f} examples/s, {2} tokens'.format(mode_, example_num / elapsed, token_num))
+
+    print('speedup: {0:.2f}x'.format(results['bucketed'][0] / results['fixed'][0]))
+    return results
+
+
+if __name__ == '__main__':
+    # python length_bucketing.py --array-dir ./checkpoint/token_cache/textsim_xxx
+    # 在CPU上比较固定长度和动态padding的训练吞吐
+    import transformers
+
+    from mmap_dataset import FoldDataset
+    from mmap_dataset import load_token_arrays
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--array-dir', required=True)
+    parser.add_argument('--model-name', default='nghuyong/ernie-1.0')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-batches', type=int, default=20)
+    args = parser.parse_args()
+
+    token_arrays = load_token_arrays(args.array_dir)
+    dataset = FoldDataset(None, token_arrays, np.arange(len(token_arrays['input_ids'])))
+
+    lengths = get_lengths(dataset)
+    fixed_tokens, dynamic_tokens, real_tokens = get_padding_stats(
+        lengths,
+        list(iter(LengthBucketBatchSampler(lengths, args.batch_size, seed=0))),
+        token_arrays['input_ids'].shape[1])
+    print('tokens per epoch: fixed {0}, bucketed {1}, real {2}'.format(fixed_tokens, dynamic_tokens, real_tokens))
+
+    module = transformers.AutoModel.from_pretrained(args.model_name)
+    report_padding_throughput(module, dataset, args.batch_size, args.max_batches, device='cpu')
@@ -0,0 +1,124 @@
+import re
+import numpy as np
+import scipy.sparse as sp
+
+# 与ES standard analyzer近似的切词: 汉字逐字切分，连续的字母/数字作为一个词，统一小写
+_CJK_RANGES = '㐀-䶿一-鿿豈-﫿'
+TOKEN_PATTERN = re.compile(
+    '[{0}]|[0-9]+(?:[.,][0-9]+)*|[^\\W_{0}]+'.format(_CJK_RANGES))
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LocalSearchEngine(object):
+    # 进程内的BM25召回，search返回与DiseaseSearchEngine相同结构的结果
+    # 打分与ES默认的BM25一致: k1=1.2, b=0.75, idf = ln(1 + (N - df + 0.5) / (df + 0.5))
+
+    def __init__(
+        self,
+        records,
+        field='surface_name',
+        index_name='local_bm25',
+        k1=1.2,
+        b=0.75,
+        ids=None
+    ):
+        self.records = records
+        # 返回结果中的_id，默认为文档的下标
+        self.ids = [str(doc_id) for doc_id in range(len(records))] if ids is None else ids
+        self.field = field
+        self.index_name = index_name
+        self.k1 = k1
+        self.b = b
+
+        self.vocab = dict()
+        rows = []
+        cols = []
+        for doc_id, record_ in enumerate(self.records):
+            for token_ in tokenize(str(record_.get(field, ''))):
+                rows.append(doc_id)
+                cols.append(self.vocab.setdefault(token_, len(self.vocab)))
+
+        doc_num = len(self.records)
+        tf = sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(doc_num, len(self.vocab)))
+        tf.sum_duplicates()
+
+        doc_length = np.asarray(tf.sum(axis=1)).ravel()
+        avg_doc_length = doc_length.mean() if doc_num > 0 else 0.0
+
+        df = np.bincount(tf.indices, minlength=len(self.vocab))
+        idf = np.log(1 + (doc_num - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        # 每个非零元素的BM25权重，查询时只需要按词取列求和
+        norm = k1 * (1 - b + b * doc_length / max(avg_doc_length, 1e-6))
+        norm = np.repeat(norm, np.diff(tf.indptr)).astype(np.float32)
+        tf.data = idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm)
+
+        self.weights = tf.tocsc()
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_index_version(self):
+        return self.index_name
+
+    def get_scores(self, _query: str):
+        term_counts = dict()
+        for token_ in tokenize(_query):
+            if token_ in self.vocab:
+                term_id = self.vocab[token_]
+                term_counts[term_id] = term_counts.get(term_id, 0) + 1
+
+        if len(term_counts) == 0:
+            return np.zeros(len(self.records), dtype=np.float32)
+
+        term_ids = np.fromiter(term_counts.keys(), dtype=np.int64)
+        counts = np.fromiter(term_counts.values(), dtype=np.float32)
+        return self.weights[:, term_ids] @ counts
+
+    def search(self, _query: str, size=20):
+        scores = self.get_scores(_query)
+
+        doc_ids = np.flatnonzero(scores > 0)
+        total = len(doc_ids)
+        if total > size:
+            # 保留所有不低于第size名分数的文档，排序后再截断，分数相同时结果稳定
+            threshold = np.partition(scores[doc_ids], total - size)[total - size]
+            doc_ids = doc_ids[scores[doc_ids] >= threshold]
+        # 分数降序，分数相同按写入顺序
+        doc_ids = doc_ids[np.lexsort((doc_ids, -scores[doc_ids]))][:size]
+
+        hits = []
+        for doc_id in doc_ids.tolist():
+            hits.append({
+                '_index': self.index_name,
+                '_id': self.ids[doc_id],
+                '_score': float(scores[doc_id]),
+                '_source': self.records[doc_id]
+            })
+
+        return {
+            'hits': {
+                'total': {'value': total, 'relation': 'eq'},
+                'max_score': hits[0]['_score'] if len(hits) > 0 else None,
+                'hits': hits
+            }
+        }
+
+    def iter_search_many(self, queries, size=20, chunk_size=None):
+        # 与DiseaseSearchEngine.iter_search_many接口一致，本地检索没有网络开销，逐个查询
+        for _query in queries:
+            yield self.search(_query, size)
+
+    def search_many(self, queries, size=20, chunk_size=None):
+        return list(self.iter_search_many(queries, size=size))
+
+
+def build_local_search_engine(train_path='./train.txt', workers=None):
+    from icd_catalog import build_catalog_search_engine
+
+    return build_catalog_search_engine(LocalSearchEngine, 'local_bm25', train_path, workers=workers)
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+TOKEN_CACHE_DIR = './checkpoint/token_cache/'
+
+
+def get_dataset_digest(data_df, tokenizer_name, max_seq_len):
+    # 数据内容、分词器和最大长度都相同时复用已分好词的数组
+    sha256 = hashlib.sha256()
+    sha256.update(pd.util.hash_pandas_object(data_df, index=False).values.tobytes())
+    sha256.update(json.dumps([list(data_df.columns), tokenizer_name, max_seq_len]).encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def save_token_arrays(features, array_dir):
+    # features: convert_to_ids之后的[{特征名: 定长list或标量}]，每个特征保存为一个[N, ...]的npy
+    tmp_dir = array_dir.rstrip('/') + '.tmp' + str(os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    for col in features[0]:
+        np.save(os.path.join(tmp_dir, col + '.npy'), np.asarray([feature_[col] for feature_ in features], dtype=np.int32))
+    os.replace(tmp_dir, array_dir)
+
+
+def load_token_arrays(array_dir):
+    # 以mmap方式打开，多个fold、多个进程共享操作系统的页缓存
+    arrays = dict()
+    for file_name in sorted(os.listdir(array_dir)):
+        if file_name.endswith('.npy'):
+            arrays[file_name[:-len('.npy')]] = np.load(os.path.join(array_dir, file_name), mmap_mode='r')
+    return arrays
+
+
+def load_or_build_token_arrays(dataset, data_df, tokenizer, name, max_seq_len, cache_dir=TOKEN_CACHE_DIR):
+    # dataset: 由data_df构建、还没有convert_to_ids的ark_nlp Dataset，缓存不存在时才分词
+    tokenizer_name = getattr(tokenizer.vocab, 'name_or_path', type(tokenizer.vocab).__name__)
+    digest = get_dataset_digest(data_df, tokenizer_name, max_seq_len)
+    array_dir = os.path.join(cache_dir, '{0}_{1}'.format(name, digest[:16]))
+
+    if not os.path.exists(array_dir):
+        dataset.convert_to_ids(tokenizer)
+        os.makedirs(cache_dir, exist_ok=True)
+        save_token_arrays(dataset.dataset, array_dir)
+
+    return load_token_arrays(array_dir)
+
+
+class TokenArrayRows(object):
+    # 按下标取出一行的特征dict，行为与convert_to_ids之后的dataset列表相同
+
+    def __init__(self, arrays, indices):
+        self.arrays = arrays
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        row_ = self.indices[idx]
+        # embedding等层需要int64
+        return {col: np.asarray(array_[row_], dtype=np.int64) for col, array_ in self.arrays.items()}
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class FoldDataset(object):
+    # 一个fold的训练/验证集: mmap数组上的下标视图，不复制数据
+    # cat2id、class_num、to_device_cols等属性沿用原来的ark_nlp Dataset
+
+    def __init__(self, base_dataset, arrays, indices):
+        self.base_dataset = base_dataset
+        self.arrays = arrays
+        self.indices = np.asarray(indices)
+        self.dataset = TokenArrayRows(arrays, self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        return self.dataset[idx]
+
+    @property
+    def to_device_cols(self):
+        # 缓存命中时原Dataset没有convert_to_ids，特征名以数组为准
+        return list(self.arrays.keys())
+
+    def __getattr__(self, name):
+        # 只有本类没有的属性才会走到这里
+        if name == 'base_dataset':
+            raise AttributeError(name)
+        return getattr(self.base_dataset, name)
@@ -0,0 +1,491 @@
+import os
+import re
+import time
+import threading
+import multiprocessing
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+i_to_num_dict = {'i':'1', 'ii':'2', 'iii':'3', 'iv':'4', 'v':'5', 'vi':'6', 'vii':'7', 'viii':'8'}
+
+digit_map = {"Ⅳ":"iv", "Ⅲ":"iii", "Ⅱ":"ii", "Ⅰ":"i", "一":"1", "二":"2", "三":"3", "四":"4", "五":"5", "六":"6"}
+
+greek_lower = [chr(ch) for ch in range(945, 970) if ch != 962]
+greek_upper = [chr(ch) for ch in range(913, 937) if ch != 930]
+greek_englist = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta", "iota", "kappa", "lambda",
+                 "mu", "nu", "xi", "omicron", "pi", "rho", "sigma", "tau", "upsilon", "phi", "chi", "psi", "omega"]
+greek_map = {ch:greek_englist[idx % 24] for idx, ch in enumerate(greek_lower + greek_upper)}
+
+prefix_suffix_src = ["部位未特指的", "未特指的", "原因不明的", "意图不确定的", "不可归类在他处", "其他特指的疾患"]
+prefix_suffix_tgt = ["部未指", "未指", "不明", "意不", "不归他", "他特指"]
+
+other_map = {'＋': '+',
+ 'pci': '经皮冠状动脉介入治疗',
+ 'cad': '冠状动脉性心脏病',
+ 'sle': '系统性红斑狼疮',
+ 'loa': '左枕前胎位',
+ 'mp': '支原体',
+ 'ou': '双眼',
+ 'mt': '恶性肿瘤',
+ 'paget': '佩吉特',
+ 'tpsa': '肿瘤标志物',
+ 'tc': '血清总胆固醇',
+ 'pbc': '原发性胆汁型肝硬化',
+ 'fgr': '胎儿生长受限',
+ 'barrett': '巴氏',
+ 'tia': '短暂性脑缺血发作',
+ 'bowen': '鲍恩',
+ 'as': '强直性脊柱炎',
+ 'dic': '弥散性血管内凝血',
+ 'hcc': '肝细胞癌',
+ 'ggo': '肺部阴影',
+ 'cushing': '库欣',
+ 'ln': '狼疮性肾炎',
+ 'prl': '泌乳素',
+ 'copd': '慢性阻塞性肺疾病',
+ 'mia': '微浸润性腺癌',
+ 'cea': '癌胚抗原',
+ 'hpv': '人乳头瘤病毒感染',
+ 'carcinoma': '恶性上皮肿瘤',
+ 'iud': '具有子宫内避孕装置',
+ 'aecopd': '急性加重期慢性阻塞性肺疾病',
+ 'gvhd': '移植物抗宿主病',
+ 'crohn': '克罗恩',
+ 'dixon': '直肠切除术',
+ 'tsh': '促甲状腺激素',
+ 'ptca': '冠状动脉腔内血管成形术',
+ 'ivf': '人工妊娠',
+ 'rop': '早产儿视网膜病',
+ 'avnrt': '房室结折返性心动过速',
+ 'cg': '慢性胃炎',
+ 'avn': '成人股骨头缺血性坏死',
+ 'rca': '右冠状动脉',
+ 'nt': '颈部透明度厚度',
+ 'nerd': '非糜烂性胃食管反流病',
+ 'sonk': '自发性膝关节骨坏死',
+ 'cabg': '冠状动脉搭桥',
+ 'burrkitt': '伯基特',
+ 'chd': '冠状动脉粥样硬化性心脏病',
+ 'hf': '心力衰竭',
+ 'chdhf': '冠心病心力衰竭',
+ 'ep': '癫痫',
+ 'simmond': '西蒙',
+ 'mgd': '睑板腺功能障碍',
+ 'fl': '滤泡性淋巴瘤',
+ 'teson': '特尔松',
+ 'ra': '类风湿性关节炎',
+ 'gd': '毒性弥漫性甲状腺肿',
+ 'poland': '波兰',
+ 'eb': '疱疹病毒',
+ 'msi': '微卫星不稳定',
+ 'pnet': '原始性神经外胚瘤',
+ 'lutembacher': '卢滕巴赫',
+ 'acl': '膝关节前交叉韧带',
+ 'he': '人附睾蛋白',
+ 'vkh': '伏格特-小柳-原田',
+ 'le': '红斑狼疮',
+ 'nyha': '纽约心脏病协会',
+ 'kt': '克利佩尔-特农纳',
+ 'rhcc': '复发性肝癌',
+ 'ige': '免疫球蛋白E',
+ 'poncet': '篷塞',
+ 'lst': '大肠侧向发育型肿瘤',
+ 'cgn': '慢性肾小球肾炎',
+ 'fsgs': '局灶节段性肾小球硬化',
+ 'gdm': '妊娠期糖尿病',
+ 'rsa': '右骶前',
+ 'htn': '高血压',
+ 'ncr': '接近完全缓解',
+ 'hunt': '亨特',
+ 'ddd': '退变性椎间盘病',
+ 'alzheimer': '阿尔茨海默',
+ 'nsclc': '非小细胞肺腺癌',
+ 'evens': '伊文氏',
+ 'mikulicz': '米库利奇',
+ 'ev': '肠病毒',
+ 'igd': '免疫球蛋白D',
+ 'chf': '充血性心力衰竭',
+ 'od': '右眼',
+ 'ipi': '国际预后指数',
+ 'dieulafoy': '迪厄拉富瓦',
+ 'lad': '左前降支',
+ 'ao': '主动脉',
+ 'hoffa': '霍法',
+ 'tunner': '特纳',
+ 'pagtes': '佩吉特',
+ 'killip': '基利普',
+ 'addison': '艾迪生',
+ 'rett': '雷特',
+ 'wernicke': '韦尼克',
+ 'castelman': '卡斯尔曼',
+ 'goldenhar': '戈尔登哈尔',
+ 'ufh': '普通肝素',
+ 'ddh': '发育性髋关节发育不良',
+ 'stevens': '史蒂文斯',
+ 'johnson': '约翰逊',
+ 'athmas': '哮喘',
+ 'rfa': '射频消融',
+ 'kippip': '基利普',
+ 'pancreaticcancer': '胰腺恶性肿瘤',
+ 'srs': '立体定向放射外科',
+ 'ama': '抗线粒体抗体',
+ 'cgd': '慢性肉芽肿病',
+ 'bmt': '骨髓移植',
+ 'sd': '脐带血流比值',
+ 'arnold': '阿诺德',
+ 'tb': '结核感染',
+ 'dvt': '下肢深静脉血栓形成',
+ 'sturge': '斯特奇',
+ 'weber': '韦伯',
+ 'smt': '黏膜下肿瘤',
+ 'ca': '恶性肿瘤',
+ 'smtca': '粘膜下恶性肿瘤',
+ 'nse': '神经元特异性烯醇化酶',
+ 'psvt': '阵发性室上性心动过速',
+ 'gaucher': '戈谢',
+ 'fai': '髋关节撞击综合征',
+ 'lop': '左枕后位',
+ 'lot': '左枕横位',
+ 'pcos': '多囊卵巢综合征',
+ 'sweet': '急性发热性嗜中性皮病',
+ 'graves': '格雷夫斯',
+ 'cdh': '先天性髋关节脱位',
+ 'enneking': '恩内金',
+ 'leep': '利普',
+ 'itp': '特发性血小板减少性紫癜',
+ 'wbc': '白细胞',
+ 'malt': '粘膜相关淋巴样组织',
+ 'naoh': '氢氧化钠',
+ 'fd': '功能性消化不良',
+ 'ck': '肌酸激酶',
+ 'hl': '霍奇金淋巴瘤',
+ 'chb': '慢性乙型肝炎',
+ 'est': '内镜下十二指肠乳头括约肌切开术',
+ 'enbd': '内镜下鼻胆管引流术',
+ 'carolis': '卡罗利斯',
+ 'lam': '淋巴管肌瘤病',
+ 'ptcd': '经皮肝穿刺胆道引流术',
+ 'alk': '间变性淋巴瘤激酶',
+ 'hunter': '亨特',
+ 'pof': '卵巢早衰',
+ 'ems': '子宫内膜异位症',
+ 'asd': '房间隔缺损',
+ 'vsd': '室间隔缺损',
+ 'pda': '动脉导管未闭',
+ 'stills': '斯蒂尔',
+ 'ecog': '东部癌症协作组',
+ 'castlemen': '卡斯尔曼',
+ 'cgvhd': '慢性移植物抗宿主病',
+ 'ards': '急性呼吸窘迫综合征',
+ 'op': '骨质疏松',
+ 'lsa': '左骶前',
+ 'afp': '甲胎蛋白',
+ 'sclc': '小细胞癌',
+ 'ecg': '心电图',
+ 'pdl': '细胞程序性死亡配体',
+ 'mss': '微卫星稳定',
+ 'masson': '马松',
+ 'ms': '多发性硬化',
+ 'tg': '甘油三酯',
+ 'cmt': '腓骨肌萎缩',
+ 'ph': '氢离子浓度指数',
+ 'dlbcl': '弥漫大B细胞淋巴瘤',
+ 'turner': '特纳',
+ 'aml': '急性骨髓系白血病',
+ 'pta': '经皮血管腔内血管成形术',
+ 'alpers': '阿尔珀斯',
+ 'tat': '破伤风抗毒素',
+ 'cavc': '完全性房室间隔缺损',
+ 'coa': '主动脉缩窄',
+ 'ggt': '谷氨酰转肽酶',
+ 'edss': '扩展残疾状态量表',
+ 'vin': '外阴上皮内瘤变',
+ 'vini': '外阴上皮内瘤变1',
+ 'vinii': '外阴上皮内瘤变2',
+ 'viniii': '外阴上皮内瘤变3',
+ 'ebv': '疱疹病毒',
+ 'dcis': '乳腺导管原位癌',
+ 'gu': '胃溃疡',
+ 'terson': '特尔松',
+ 'oa': '骨关节炎',
+ 'cin': '宫颈上皮内瘤变'
+}
+
+prefix_suffix_src_x = ["恶性","癌", "慢支", "化疗", "皮肤", "胃口", "节育器",
+                        "左甲","右甲","腮裂","白内障","小便","停经","积血"]
+
+prefix_suffix_tgt_x = ["恶性肿瘤","癌恶性肿瘤","慢性支气管炎","化学治疗","皮肤和皮下组织", "食欲","避孕环",
+                        "左甲状腺","右甲状腺","鳃裂","白内障眼","尿","孕","积血肿"]
+
+def extend_x(string):
+    for idx, replace_str in enumerate(prefix_suffix_src_x):
+        string = string.replace(replace_str, prefix_suffix_tgt_x[idx])
+    return string
+
+
+_cache_missing = object()
+
+
+class LRUCache(object):
+
+    def __init__(self, capacity=100000):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+
+        self.capacity = capacity
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def cache_info(self):
+        with self._lock:
+            total_ = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'capacity': self.capacity,
+                'hit_rate': self.hits / total_ if total_ else 0.0
+            }
+
+
+class Normalizer(object):
+
+    def __init__(
+        self,
+        digit_map=digit_map,
+        greek_map=greek_map,
+        prefix_suffix_src=prefix_suffix_src,
+        prefix_suffix_tgt=prefix_suffix_tgt,
+        i_to_num_dict=i_to_num_dict,
+        other_map=other_map,
+        record_timing=False,
+        cache_size=0
+    ):
+        self.i_to_num_dict = dict(i_to_num_dict)
+        self.other_map = dict(other_map)
+        self.prefix_suffix_pairs = list(zip(prefix_suffix_src, prefix_suffix_tgt))
+
+        # clean_digit按ch.upper()查表，小写罗马数字(ⅰ ⅱ ...)也要进表
+        self.digit_table = str.maketrans({ch: digit_map[ch.upper()]
+                                          for key in digit_map
+                                          for ch in (key, key.lower())
+                                          if ch.upper() in digit_map})
+        self.greek_table = str.maketrans(greek_map)
+
+        self.index_pattern = re.compile('[0-9]\\.')
+        self.letter_run_pattern = re.compile('[a-zA-Z]+')
+        self.i_to_num_head_pattern = re.compile('^v?i+v?')
+        self.i_to_num_tail_pattern = re.compile('v?i+v?$')
+
+        self.record_timing = record_timing
+        self.reset_timing()
+
+        # cache_size > 0 时开启LRU缓存，同一个Normalizer可在多线程间共享
+        self.cache = LRUCache(cache_size) if cache_size else None
+
+    def clean_index(self, string):
+        # 1. 2.
+        return self.index_pattern.sub(' ', string)
+
+    def clean_prefix_suffix(self, string):
+        for src_, tgt_ in self.prefix_suffix_pairs:
+            string = string.replace(src_, tgt_)
+        return string
+
+    def clean_greek(self, string):
+        return string.translate(self.greek_table)
+
+    def clean_digit(self, string):
+        # Ⅳ Ⅲ Ⅱ Ⅰ
+        # IV III II I
+        # 4 3 2 1
+        # 四 三 二 一
+        return string.translate(self.digit_table)
+
+    def clean_other(self, string):
+        # oa
+        # "＋"="+"
+        # aoux not replace ou
+        # 一次扫描所有字母串，只替换两侧都不是字母的完整缩写。
+        # 旧实现逐个缩写做re.sub，相邻的同一缩写共用一个分隔符时后一个不会被替换，这里保持一致
+        string = string.replace('＋', '+')
+
+        pieces = []
+        last_end = 0
+        last_word = None
+        last_replaced = False
+        for matched in self.letter_run_pattern.finditer(string):
+            word = matched.group()
+            start, end = matched.span()
+            if word in self.other_map and not (last_replaced and word == last_word and start - last_end == 1):
+                pieces.append(string[last_end:start])
+                pieces.append(self.other_map[word])
+                last_replaced = True
+            else:
+                pieces.append(string[last_end:end])
+                last_replaced = False
+            last_word = word
+            last_end = end
+        pieces.append(string[last_end:])
+
+        return ''.join(pieces).strip(' ')
+
+    def _match_i_to_num(self, substring):
+        word = substring.group()
+        abbr = self.i_to_num_head_pattern.search(word)
+        if not abbr:
+            abbr = self.i_to_num_tail_pattern.search(word)
+        if not abbr:
+            return word
+        abbr = abbr.group()
+        return word.replace(abbr, self.i_to_num_dict[abbr])
+
+    def i_to_num(self, string):
+        if 'i' in string:
+            string = self.letter_run_pattern.sub(self._match_i_to_num, string)
+        return string
+
+    def _lower(self, string):
+        return string.replace("\"", " ").lower()
+
+    def clean(self, string):
+        if self.cache is None:
+            return self._clean(string)
+
+        cleaned = self.cache.get(string, _cache_missing)
+        if cleaned is _cache_missing:
+            cleaned = self._clean(string)
+            self.cache.put(string, cleaned)
+        return cleaned
+
+    def _clean(self, string):
+        if self.record_timing:
+            return self._clean_with_timing(string)
+
+        string = string.replace("\"", " ").lower()
+        string = self.clean_index(string)
+        string = self.clean_prefix_suffix(string)
+        string = self.clean_greek(string)
+        string = self.clean_digit(string)
+        string = self.clean_other(string)
+        string = self.i_to_num(string)
+        string = self.clean_other(string)
+        return string.lower()
+
+    def _clean_with_timing(self, string):
+        stages = [
+            ('lower', self._lower),
+            ('clean_index', self.clean_index),
+            ('clean_prefix_suffix', self.clean_prefix_suffix),
+            ('clean_greek', self.clean_greek),
+            ('clean_digit', self.clean_digit),
+            ('clean_other', self.clean_other),
+            ('i_to_num', self.i_to_num),
+            ('clean_other', self.clean_other),
+            ('lower', str.lower),
+        ]
+        for stage_name_, stage_ in stages:
+            start_ns = time.perf_counter_ns()
+            string = stage_(string)
+            self.stage_timings[stage_name_] = self.stage_timings.get(stage_name_, 0) + time.perf_counter_ns() - start_ns
+            self.stage_counts[stage_name_] = self.stage_counts.get(stage_name_, 0) + 1
+        return string
+
+    def reset_timing(self):
+        self.stage_timings = dict()
+        self.stage_counts = dict()
+
+    def timing_report(self):
+        # [(stage, 总耗时ns, 调用次数, 平均耗时ns)]，按总耗时降序
+        report = []
+        for stage_name_, total_ns in self.stage_timings.items():
+            count_ = self.stage_counts[stage_name_]
+            report.append((stage_name_, total_ns, count_, total_ns / count_))
+        return sorted(report, key=lambda x: x[1], reverse=True)
+
+
+normalizer = Normalizer()
+
+clean = normalizer.clean
+clean_other = normalizer.clean_other
+
+
+def _clean_chunk(strings):
+    return [clean(string) for string in strings]
+
+
+def _get_mp_context():
+    # 脚本都没有 if __name__ == '__main__' 保护，spawn会在子进程里重新执行整个脚本，能fork就fork
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def clean_many(strings, workers=None, chunksize=2000):
+    # 按chunksize切块分发到进程池，结果顺序与输入一致
+    strings = list(strings)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(strings) <= chunksize:
+        return _clean_chunk(strings)
+
+    chunks = [strings[idx:idx + chunksize] for idx in range(0, len(strings), chunksize)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=_get_mp_context()) as executor:
+        cleaned_chunks = list(executor.map(_clean_chunk, chunks))
+
+    return [cleaned for cleaned_chunk in cleaned_chunks for cleaned in cleaned_chunk]
+
+
+if __name__ == '__main__':
+    # python normalizer.py: 在train.txt和test.txt上输出clean各阶段耗时
+    # 与旧实现的一致性校验见tests/test_normalizer.py
+    texts = []
+    if os.path.exists('./train.txt'):
+        with open('./train.txt', encoding='utf-8') as f:
+            for line_ in f.read().splitlines():
+                text_, _, normalized_result_ = line_.partition('\t')
+                texts.append(text_)
+                texts.extend(normalized_result_.split('##'))
+    if os.path.exists('./test.txt'):
+        with open('./test.txt', encoding='utf-8') as f:
+            texts.extend(f.read().splitlines())
+
+    timing_normalizer = Normalizer(record_timing=True)
+    for text_ in texts:
+        timing_normalizer.clean(text_)
+    for stage_name_, total_ns, count_, mean_ns in timing_normalizer.timing_report():
+        print('{0:<20}{1:>14}ns{2:>10}{3:>12.1f}ns'.format(stage_name_, total_ns, count_, mean_ns))
@@ -40,7 +40,18 @@ max_seq_length=100
 
 tokenizer = Tokenizer(bert_vocab, max_seq_length)
 
-tc_dataset.convert_to_ids(tokenizer)
+# 分词结果以定长npy数组缓存在./checkpoint/token_cache/，mmap打开，各fold共享同一份
+from mmap_dataset import FoldDataset
+from mmap_dataset import load_or_build_token_arrays
+
+token_arrays = load_or_build_token_arrays(tc_dataset, train_data_df, tokenizer, 'predictnum', max_seq_length)
+
+# 训练时按长度分桶取batch，每个batch只补齐到batch内最长的样本，而不是固定补齐到max_seq_len
+from length_bucketing import LengthBucketBatchSampler
+from length_bucketing import dynamic_padding_collate_fn
+from length_bucketing import get_lengths
+
+use_length_bucketing = True
 
 torch.cuda.empty_cache()
 
@@ -88,7 +99,14 @@ class AttackTask(Task):
         else:
             self.train_to_device_cols = train_to_device_cols
 
-        train_generator = DataLoader(train_data, batch_size=batch_size, shuffle=True, collate_fn=self._collate_fn)
+        if use_length_bucketing:
+            train_generator = DataLoader(
+                train_data,
+                batch_sampler=LengthBucketBatchSampler(get_lengths(train_data), batch_size),
+                collate_fn=dynamic_padding_collate_fn
+            )
+        else:
+            train_generator = DataLoader(train_data, batch_size=batch_size, shuffle=True, collate_fn=self._collate_fn)
         self.train_generator_lenth = len(train_generator)
             
         self.optimizer = get_optimizer(self.optimizer, self.module, lr, params)
@@ -135,18 +153,16 @@ class AttackTask(Task):
         return loss
     
 import gc
-import copy
 from transformers import BertConfig
 from sklearn.model_selection import KFold
 
 kf = KFold(10, shuffle=True, random_state=42)
 
-examples = copy.deepcopy(tc_dataset.dataset)
-
-for fold_, (train_ids, dev_ids) in enumerate(kf.split(examples)):
+for fold_, (train_ids, dev_ids) in enumerate(kf.split(np.arange(len(token_arrays['input_ids'])))):
 
-    tc_train_dataset.dataset = [examples[_idx] for _idx in train_ids]
-    tc_dev_dataset.dataset = [examples[_idx] for _idx in dev_ids]
+    # fold只是token_arrays上的下标视图
+    tc_train_dataset = FoldDataset(tc_dataset, token_arrays, train_ids)
+    tc_dev_dataset = FoldDataset(tc_dataset, token_arrays, dev_ids)
 
     bert_config = BertConfig.from_pretrained('nghuyong/ernie-1.0', 
                                              num_labels=len(tc_train_dataset.cat2id))
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+
+RECALL_CACHE_PATH = './checkpoint/recall_cache.sqlite'
+RECALL_CACHE_MAX_ENTRIES = 50000
+
+# CachedSearchEngine.iter_search_many每次查缓存、补查未命中的query数
+CACHE_CHUNK_SIZE = 500
+
+
+class RecallCache(object):
+    # 召回结果的磁盘缓存，key为(clean后的query, size, 索引版本)
+    # 条目数超过max_entries时按最近访问时间淘汰
+
+    def __init__(
+        self,
+        cache_path=RECALL_CACHE_PATH,
+        max_entries=RECALL_CACHE_MAX_ENTRIES
+    ):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir != '':
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS recall ('
+            'query TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'index_version TEXT NOT NULL, '
+            'result BLOB NOT NULL, '
+            'last_access REAL NOT NULL, '
+            'PRIMARY KEY (query, size, index_version))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS recall_last_access ON recall (last_access)')
+        self.conn.commit()
+
+    def get_many(self, queries, size, index_version):
+        # 返回{query: 结果}，只包含命中的query
+        results = dict()
+        queries = list(set(queries))
+        # sqlite单条语句的参数个数有限制，分批查询
+        for start in range(0, len(queries), 500):
+            chunk = queries[start:start + 500]
+            rows = self.conn.execute(
+                'SELECT query, result FROM recall WHERE size = ? AND index_version = ? '
+                'AND query IN ({0})'.format(','.join('?' * len(chunk))),
+                [size, index_version] + chunk).fetchall()
+            for query_, result_ in rows:
+                results[query_] = json.loads(zlib.decompress(result_).decode('utf-8'))
+
+        if len(results) > 0:
+            now = time.time()
+            self.conn.executemany(
+                'UPDATE recall SET last_access = ? WHERE query = ? AND size = ? AND index_version = ?',
+                [(now, query_, size, index_version) for query_ in results])
+            self.conn.commit()
+
+        return results
+
+    def get(self, _query, size, index_version):
+        return self.get_many([_query], size, index_version).get(_query)
+
+    def put_many(self, items, size, index_version):
+        # items: [(query, 结果)]
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO recall (query, size, index_version, result, last_access) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(query_, size, index_version,
+              zlib.compress(json.dumps(result_, ensure_ascii=False).encode('utf-8')), now)
+             for query_, result_ in items])
+        self.evict()
+        self.conn.commit()
+
+    def put(self, _query, size, index_version, result):
+        self.put_many([(_query, result)], size, index_version)
+
+    def evict(self):
+        entry_num = len(self)
+        if entry_num > self.max_entries:
+            self.conn.execute(
+                'DELETE FROM recall WHERE rowid IN '
+                '(SELECT rowid FROM recall ORDER BY last_access LIMIT ?)',
+                (entry_num - self.max_entries,))
+
+    def invalidate(self, index_version=None):
+        # index_version为None时清空全部缓存，返回删除的条目数
+        if index_version is None:
+            cursor = self.conn.execute('DELETE FROM recall')
+        else:
+            # 只返回部分字段的条目版本号为'索引|_source=...'，同一个索引的一起删除
+            # 索引名中的'_'在LIKE里是通配符，用前缀比较
+            cursor = self.conn.execute(
+                'DELETE FROM recall WHERE index_version = ? OR substr(index_version, 1, ?) = ?',
+                (index_version, len(index_version) + 1, index_version + '|'))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM recall').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class CachedSearchEngine(object):
+    # 在search_engine前加一层RecallCache，接口与DiseaseSearchEngine一致
+    # 出错的结果(带'error')不写入缓存
+
+    def __init__(
+        self,
+        search_engine,
+        cache=None,
+        index_version=None
+    ):
+        self.search_engine = search_engine
+        self.cache = RecallCache() if cache is None else cache
+        # 默认用别名当前指向的索引作为版本号，别名切换后自动使用新的缓存条目
+        self.index_version = search_engine.get_index_version() if index_version is None else index_version
+        # 只返回部分字段的结果与完整结果分开缓存
+        source_fields = getattr(search_engine, 'source_fields', None)
+        if index_version is None and source_fields is not None:
+            self.index_version += '|_source=' + ','.join(source_fields)
+
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, _query: str, size=20):
+        return self.search_many([_query], size)[0]
+
+    def iter_search_many(self, queries, size=20, chunk_size=CACHE_CHUNK_SIZE):
+        queries = list(queries)
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+
+            cached = self.cache.get_many(chunk, size, self.index_version)
+            # 命中率按位置统计: 同一块内重复的未命中query只查询一次，但每次都计为未命中
+            uncached = [query_ for query_ in chunk if query_ not in cached]
+            missing = list(dict.fromkeys(uncached))
+
+            if len(missing) > 0:
+                fetched = self.search_engine.search_many(missing, size)
+                self.cache.put_many(
+                    [(query_, result_) for query_, result_ in zip(missing, fetched) if 'error' not in result_],
+                    size,
+                    self.index_version)
+                cached.update(zip(missing, fetched))
+
+            self.hits += len(chunk) - len(uncached)
+            self.misses += len(uncached)
+
+            for query_ in chunk:
+                yield cached[query_]
+
+    def search_many(self, queries, size=20, chunk_size=CACHE_CHUNK_SIZE):
+        return list(self.iter_search_many(queries, size=size, chunk_size=chunk_size))
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.cache),
+            'index_version': self.index_version
+        }
+
+
+if __name__ == '__main__':
+    # python recall_cache.py --invalidate [--index-version icd_diagnose_20210601120000]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-path', default=RECALL_CACHE_PATH)
+    parser.add_argument('--invalidate', action='store_true')
+    parser.add_argument('--index-version', default=None)
+    args = parser.parse_args()
+
+    recall_cache = RecallCache(args.cache_path)
+    if args.invalidate:
+        print('invalidated {0} entries'.format(recall_cache.invalidate(args.index_version)))
+    print('recall cache: {0} entries'.format(len(recall_cache)))
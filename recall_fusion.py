@@ -0,0 +1,81 @@
+from collections import Counter
+from collections import OrderedDict
+
+# RRF的平滑常数，常用取值60
+RRF_K = 60
+
+
+class FusedCandidate(object):
+
+    def __init__(self, entity_name):
+        self.entity_name = entity_name
+        self.score = 0.0
+        # {通道名: 在该通道中的名次(从1开始)}
+        self.ranks = OrderedDict()
+
+    def __repr__(self):
+        return 'FusedCandidate({0!r}, {1:.4f}, {2})'.format(self.entity_name, self.score, dict(self.ranks))
+
+
+def reciprocal_rank_fusion(channels, weights=None, top_k=None, rrf_k=RRF_K):
+    # channels: OrderedDict{通道名: 按相关性排好序的标准词列表}
+    # 每个标准词的分数为sum(weight / (rrf_k + rank))，同一通道内重复的词只取最靠前的名次
+    # 返回按分数降序的FusedCandidate列表，分数相同时按通道顺序和名次先后，最多top_k个
+    weights = dict() if weights is None else weights
+
+    candidates = OrderedDict()
+    for channel_, entity_names in channels.items():
+        weight = weights.get(channel_, 1.0)
+        rank = 0
+        for entity_name in entity_names:
+            candidate = candidates.get(entity_name)
+            if candidate is None:
+                candidate = FusedCandidate(entity_name)
+                candidates[entity_name] = candidate
+            elif channel_ in candidate.ranks:
+                continue
+
+            rank += 1
+            candidate.ranks[channel_] = rank
+            candidate.score += weight / (rrf_k + rank)
+
+    fused = sorted(candidates.values(), key=lambda x: x.score, reverse=True)
+    if top_k is not None:
+        fused = fused[:top_k]
+    return fused
+
+
+class RecallFusionReport(object):
+    # 统计各召回通道的贡献: 提供的候选数、融合截断后保留的候选数、只由该通道召回的保留候选数，
+    # 以及批量召回出错后重新查询的query数
+
+    def __init__(self):
+        self.query_num = 0
+        self.recalled = Counter()
+        self.kept = Counter()
+        self.kept_only = Counter()
+        self.retried = Counter()
+        self.candidate_num = 0
+        self.fused_num = 0
+
+    def update(self, channels, fused):
+        self.query_num += 1
+        self.candidate_num += len(set(name for names in channels.values() for name in names))
+        self.fused_num += len(fused)
+
+        for channel_, entity_names in channels.items():
+            self.recalled[channel_] += len(set(entity_names))
+
+        for candidate in fused:
+            for channel_ in candidate.ranks:
+                self.kept[channel_] += 1
+            if len(candidate.ranks) == 1:
+                self.kept_only[next(iter(candidate.ranks))] += 1
+
+    def report(self):
+        lines = ['recall fusion: {0} queries, {1} -> {2} candidates'.format(
+            self.query_num, self.candidate_num, self.fused_num)]
+        for channel_ in self.recalled:
+            lines.append('{0:>8s}: recalled {1:8d}  kept {2:8d}  kept only by this channel {3:8d}  retried {4:6d}'.format(
+                channel_, self.recalled[channel_], self.kept[channel_], self.kept_only[channel_], self.retried[channel_]))
+        return '\n'.join(lines)
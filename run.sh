@@ -8,6 +8,7 @@ pip install pandas
 pip install elasticsearch
 pip install openpyxl
 pip install python-Levenshtein
+python icd_catalog.py
 python data_process.py
 python textsim.py
 python predictnum.py
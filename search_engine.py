@@ -0,0 +1,279 @@
+import os
+import asyncio
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 可以用环境变量ES_HOST/ES_PORT指向其他ES，比如es_standin.py启动的本地替身
+ES_HOSTS = [{"host": os.environ.get('ES_HOST', 'ES IP'), "port": os.environ.get('ES_PORT', 'ES port')}]
+# 读写都通过别名，es_index.py建好新版本索引后原子地切换别名指向
+ES_INDEX_ALIAS = 'icd_diagnose'
+
+# search_many每次_msearch请求包含的query数
+MSEARCH_CHUNK_SIZE = 50
+
+# AsyncDiseaseSearchEngine同时在途的请求数和单个请求的超时时间(秒)
+ASYNC_MAX_CONCURRENCY = 32
+ASYNC_REQUEST_TIMEOUT = 10
+
+
+def get_match_dsl(_query: str, source_fields=None):
+    dsl = {
+        "query": {
+            "match": {
+                "surface_name": {
+                    'query': _query,
+#                     "analyzer": "ik_smart"
+                }
+              }
+            },
+        "sort": [
+            {
+                "_score": {
+                    "order": "desc"
+                }
+            }
+        ]
+    }
+    # 只返回需要的字段，比如召回只用到entity_name
+    if source_fields is not None:
+        dsl['_source'] = source_fields
+    return dsl
+
+
+def get_error_result(error):
+    # 单个query失败时的占位结果，结构与正常结果相同，hits为空
+    return {
+        'error': error,
+        'hits': {
+            'total': {'value': 0, 'relation': 'eq'},
+            'max_score': None,
+            'hits': []
+        }
+    }
+
+
+class SearchError(Exception):
+    pass
+
+
+def retry_failed_search(search_engine, _query, size, search_result, retries=1):
+    # 批量召回中出错的query得到的是带'error'、hits为空的占位结果，直接使用会让召回悄悄变空
+    # 用search_engine.search重新查询，重试后仍然出错时抛出SearchError
+    for _ in range(retries):
+        if 'error' not in search_result:
+            break
+        search_result = search_engine.search(_query, size)
+
+    if 'error' in search_result:
+        raise SearchError('search failed for {0!r}: {1}'.format(_query, search_result['error']))
+    return search_result
+
+
+def get_client_errors(es):
+    # 请求失败时客户端抛出的异常类型: elasticsearch客户端为ElasticsearchException，
+    # es_standin.InMemoryElasticsearch为StandInError，后者不需要安装elasticsearch
+    if type(es).__module__.split('.')[0] == 'elasticsearch':
+        from elasticsearch.exceptions import ElasticsearchException
+        return (ElasticsearchException,)
+
+    from es_standin import StandInError
+    return (StandInError,)
+
+
+class DiseaseSearchEngine:
+    def __init__(self, hosts=None, index_name=ES_INDEX_ALIAS, es=None, msearch_workers=1, source_fields=None):
+        # es: 直接传入客户端，比如es_standin.InMemoryElasticsearch
+        if es is None:
+            # 延迟导入，使用本地召回(local_search)的机器不需要安装elasticsearch
+            from elasticsearch import Elasticsearch
+
+            es = Elasticsearch(hosts=ES_HOSTS if hosts is None else hosts)
+
+        self.es = es
+        self.index_name = index_name
+        self.msearch_workers = msearch_workers
+        self.source_fields = source_fields
+        self.client_errors = get_client_errors(es)
+
+    def get_index_version(self):
+        # 别名当前指向的具体索引，作为召回缓存的版本号；index_name不是别名时返回其本身
+        if self.es.indices.exists_alias(name=self.index_name):
+            return sorted(self.es.indices.get_alias(name=self.index_name).keys())[-1]
+        return self.index_name
+
+    def search(self, _query: str, size=20):
+        dsl = get_match_dsl(_query, self.source_fields)
+
+        result = self.es.search(index=self.index_name, body=dsl, size=size)
+        
+        return result
+
+    def _msearch_chunk(self, chunk, size):
+        body = []
+        for _query in chunk:
+            dsl = get_match_dsl(_query, self.source_fields)
+            dsl['size'] = size
+            body.append({'index': self.index_name})
+            body.append(dsl)
+
+        try:
+            responses = self.es.msearch(body=body)['responses']
+        except self.client_errors as e:
+            responses = [{'error': repr(e)}] * len(chunk)
+
+        return [
+            get_error_result(response_['error']) if 'error' in response_ else response_
+            for response_ in responses
+        ]
+
+    def iter_search_many(self, queries, size=20, chunk_size=MSEARCH_CHUNK_SIZE):
+        # 按chunk_size把query合并成_msearch请求，按输入顺序逐个返回结果
+        # 单个query出错或整个请求失败时，对应位置返回get_error_result，不影响其他query
+        # msearch_workers > 1时多个_msearch请求并发发送，在途请求最多msearch_workers * 2个
+        queries = list(queries)
+        chunks = [queries[start:start + chunk_size] for start in range(0, len(queries), chunk_size)]
+
+        if self.msearch_workers <= 1:
+            for chunk in chunks:
+                for result_ in self._msearch_chunk(chunk, size):
+                    yield result_
+            return
+
+        with ThreadPoolExecutor(max_workers=self.msearch_workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                if len(pending) >= self.msearch_workers * 2:
+                    for result_ in pending.popleft().result():
+                        yield result_
+                pending.append(executor.submit(self._msearch_chunk, chunk, size))
+
+            while len(pending) > 0:
+                for result_ in pending.popleft().result():
+                    yield result_
+
+    def search_many(self, queries, size=20, chunk_size=MSEARCH_CHUNK_SIZE):
+        return list(self.iter_search_many(queries, size=size, chunk_size=chunk_size))
+
+
+class AsyncDiseaseSearchEngine:
+    # 基于AsyncElasticsearch的召回，iter_search同时保持至多max_concurrency个请求在途，
+    # 按完成顺序返回(下标, 结果)；超时或出错的query返回get_error_result
+
+    def __init__(
+        self,
+        hosts=None,
+        index_name=ES_INDEX_ALIAS,
+        max_concurrency=ASYNC_MAX_CONCURRENCY,
+        request_timeout=ASYNC_REQUEST_TIMEOUT,
+        source_fields=None
+    ):
+        from elasticsearch import AsyncElasticsearch
+
+        self.es = AsyncElasticsearch(hosts=ES_HOSTS if hosts is None else hosts)
+        self.index_name = index_name
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.source_fields = source_fields
+        # Semaphore要在事件循环中创建，第一次search时再初始化
+        self._semaphore = None
+
+    async def search(self, _query: str, size=20):
+        from elasticsearch.exceptions import ElasticsearchException
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        dsl = get_match_dsl(_query, self.source_fields)
+
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(
+                    self.es.search(index=self.index_name, body=dsl, size=size),
+                    self.request_timeout)
+            except asyncio.TimeoutError:
+                return get_error_result('timeout')
+            except ElasticsearchException as e:
+                return get_error_result(repr(e))
+
+    async def _indexed_search(self, index_, _query, size):
+        return index_, await self.search(_query, size)
+
+    async def iter_search(self, queries, size=20):
+        # 只在有空位时才创建新任务，queries可以是很长的生成器
+        pending = set()
+        for index_, _query in enumerate(queries):
+            if len(pending) >= self.max_concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task_ in done:
+                    yield task_.result()
+            pending.add(asyncio.ensure_future(self._indexed_search(index_, _query, size)))
+
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task_ in done:
+                yield task_.result()
+
+    async def search_many(self, queries, size=20):
+        # 按输入顺序返回全部结果
+        queries = list(queries)
+        results = [None] * len(queries)
+        async for index_, result_ in self.iter_search(queries, size):
+            results[index_] = result_
+        return results
+
+    async def close(self):
+        await self.es.close()
+
+
+def async_search_many(queries, size=20, **kwargs):
+    # 同步代码里使用AsyncDiseaseSearchEngine批量召回
+    async def _run():
+        search_engine = AsyncDiseaseSearchEngine(**kwargs)
+        try:
+            return await search_engine.search_many(queries, size)
+        finally:
+            await search_engine.close()
+
+    return asyncio.run(_run())
+
+
+def search_many_with_depth_budget(
+    search_engine,
+    queries,
+    is_enough,
+    initial_size=20,
+    max_depth=1000,
+    growth=4
+):
+    # 按深度预算召回: 先取initial_size个结果，is_enough(下标, 结果)为False且结果已取满的query，
+    # 把size乘以growth重新召回，直到够用、没有更多结果或达到max_depth；返回按输入顺序的结果
+    queries = list(queries)
+    results = [None] * len(queries)
+    pending = list(range(len(queries)))
+    size = min(initial_size, max_depth)
+    while len(pending) > 0:
+        next_pending = []
+        for index_, result_ in zip(pending, search_engine.search_many([queries[idx] for idx in pending], size)):
+            results[index_] = result_
+            if size < max_depth and len(result_['hits']['hits']) >= size and not is_enough(index_, result_):
+                next_pending.append(index_)
+        pending = next_pending
+        size = min(size * growth, max_depth)
+    return results
+
+
+def get_search_engine(backend='es', source_fields=None, **kwargs):
+    # 'es': 远程ES召回; 'local': 进程内BM25召回，不依赖ES服务
+    # 'tfidf': 字符n-gram TF-IDF召回，整批query一次稀疏矩阵乘法，适合离线批量任务
+    # source_fields只对'es'有效，本地召回没有传输开销
+    if backend == 'es':
+        return DiseaseSearchEngine(source_fields=source_fields, **kwargs)
+    elif backend == 'local':
+        from local_search import build_local_search_engine
+        return build_local_search_engine(**kwargs)
+    elif backend == 'tfidf':
+        from tfidf_recall import build_tfidf_search_engine
+        return build_tfidf_search_engine(**kwargs)
+    else:
+        raise ValueError('unknown search backend: ' + str(backend))
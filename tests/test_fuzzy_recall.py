@@ -0,0 +1,20 @@
+from fuzzy_recall import FuzzyNameIndex
+
+NAMES = ['小心脏', '心脏', '心脏起搏器置入', '心脏起搏器调整', '胃恶性肿瘤', '肺恶性肿瘤术后化学治疗']
+
+
+def test_short_names_do_not_match_unrelated_queries():
+    fuzzy_index = FuzzyNameIndex(NAMES, max_distance=1)
+
+    # '小心脏'与query只有2个字相同，编辑距离为1，但不应该被召回
+    assert fuzzy_index.search('心脏起博器置入') == [('心脏起搏器置入', 1)]
+    assert all(len(name_) >= 4 for name_, _ in fuzzy_index.search('小心脏病'))
+
+
+def test_long_names_match_typos():
+    fuzzy_index = FuzzyNameIndex(NAMES, max_distance=2)
+
+    assert fuzzy_index.search('胃恶性肿留') == [('胃恶性肿瘤', 1)]
+    # 11个字允许2处编辑，5个字只允许1处
+    assert ('肺恶性肿瘤术后化学治疗', 2) in fuzzy_index.search('肺恶姓肿瘤术后化疗治疗')
+    assert fuzzy_index.search('胃恶姓肿留') == []
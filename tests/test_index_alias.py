@@ -0,0 +1,41 @@
+import pytest
+
+from es_standin import InMemoryElasticsearch
+from index_alias import swap_alias
+from index_alias import rollback_alias
+from index_alias import get_index_versions
+from index_alias import delete_old_versions
+
+LEGACY_INDEX = 'icd_diagnose_test_20210601'
+VERSIONS = ['icd_diagnose_20210601120000', 'icd_diagnose_20210602120000', 'icd_diagnose_20210603120000']
+
+
+def build_standin():
+    es = InMemoryElasticsearch()
+    for index_name in [LEGACY_INDEX] + VERSIONS:
+        es.indices.create(index=index_name)
+    swap_alias(es, 'icd_diagnose', VERSIONS[-1])
+    return es
+
+
+def test_versions_exclude_other_indices_with_alias_prefix():
+    assert get_index_versions(build_standin(), 'icd_diagnose') == VERSIONS
+
+
+def test_rollback_and_cleanup_leave_legacy_index_alone():
+    es = build_standin()
+
+    assert rollback_alias(es, 'icd_diagnose') == VERSIONS[-2]
+    swap_alias(es, 'icd_diagnose', VERSIONS[-1])
+
+    delete_old_versions(es, 'icd_diagnose', keep=1)
+    assert sorted(es.indices.get(index='*').keys()) == [VERSIONS[-1], LEGACY_INDEX]
+
+
+def test_rollback_from_legacy_index_is_refused():
+    # 别名还指向迁移前的旧索引时，旧索引不是版本之一，没有可以回滚的版本
+    es = build_standin()
+    swap_alias(es, 'icd_diagnose', LEGACY_INDEX)
+
+    with pytest.raises(ValueError):
+        rollback_alias(es, 'icd_diagnose')
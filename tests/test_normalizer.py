@@ -0,0 +1,76 @@
+import os
+import re
+import random
+
+import pytest
+
+from normalizer import other_map
+from normalizer import clean_other
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAIN_PATH = os.path.join(REPO_DIR, 'train.txt')
+TEST_PATH = os.path.join(REPO_DIR, 'test.txt')
+
+
+def match(substring):
+    abbr = re.search('[a-z]+', substring.groupdict()['pat']).group()
+    matched = re.sub(abbr, other_map[abbr], substring.groupdict()['pat'])
+    return matched
+
+
+def legacy_clean_other(string):
+    # 原来逐个缩写做re.sub的实现，clean_other必须与它逐字一致
+    for item in list(other_map.keys()):
+        if item == "＋":
+            string = re.sub(item, other_map[item], ' '+string+' ')
+        else:
+            string = re.sub('(?P<pat>[^a-zA-Z]'+item+'[^a-zA-Z])', match, ' '+string+' ')
+    return string.strip(' ')
+
+
+def read_data_texts():
+    texts = []
+    if os.path.exists(TRAIN_PATH):
+        with open(TRAIN_PATH, encoding='utf-8') as f:
+            for line_ in f.read().splitlines():
+                text_, _, normalized_result_ = line_.partition('\t')
+                texts.append(text_)
+                texts.extend(normalized_result_.split('##'))
+    if os.path.exists(TEST_PATH):
+        with open(TEST_PATH, encoding='utf-8') as f:
+            texts.extend(f.read().splitlines())
+    return texts
+
+
+def generate_texts(num, seed=0):
+    # 缩写、相邻的同一缩写、大写、非ASCII字母、＋和各种分隔符随机拼接
+    rng = random.Random(seed)
+    abbrs = [key_ for key_ in other_map if key_ != '＋']
+    pieces = abbrs + ['ii', 'iv', 'x', 'AS', 'Copd', 'é', '＋', '+', '1.', '2', ' ', '  ', '-', '/', '(', ')', '癌', '术后']
+    texts = []
+    for _ in range(num):
+        words = [rng.choice(pieces) for _ in range(rng.randint(1, 8))]
+        texts.append(''.join(words) if rng.random() < 0.3 else rng.choice([' ', '', '癌', ',']).join(words))
+    return texts
+
+
+def assert_same_as_legacy(texts):
+    mismatches = []
+    for text_ in texts:
+        for string_ in (text_, text_.lower()):
+            if clean_other(string_) != legacy_clean_other(string_):
+                mismatches.append((string_, clean_other(string_), legacy_clean_other(string_)))
+    assert mismatches[:10] == []
+
+
+def test_clean_other_matches_legacy_on_generated_texts():
+    assert_same_as_legacy(generate_texts(2000))
+
+
+@pytest.mark.skipif(
+    not os.path.exists(TRAIN_PATH) and not os.path.exists(TEST_PATH),
+    reason='train.txt and test.txt are not in the repo root')
+def test_clean_other_matches_legacy_on_data_files():
+    texts = read_data_texts()
+    assert len(texts) > 0
+    assert_same_as_legacy(texts)
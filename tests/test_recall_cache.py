@@ -0,0 +1,32 @@
+from recall_cache import RecallCache
+from recall_cache import CachedSearchEngine
+
+
+class CountingSearchEngine(object):
+
+    def __init__(self):
+        self.searched = []
+
+    def get_index_version(self):
+        return 'icd_diagnose_test'
+
+    def search_many(self, queries, size=20):
+        self.searched.extend(queries)
+        return [{'hits': {'hits': [{'_source': {'entity_name': query_}}]}} for query_ in queries]
+
+
+def test_duplicate_cold_queries_count_as_misses():
+    search_engine = CountingSearchEngine()
+    cached_engine = CachedSearchEngine(search_engine, cache=RecallCache(':memory:'))
+
+    results = cached_engine.search_many(['a', 'b', 'c'] * 3, size=1)
+
+    assert [result_['hits']['hits'][0]['_source']['entity_name'] for result_ in results] == ['a', 'b', 'c'] * 3
+    # 重复的query只查询一次，但命中率按位置统计
+    assert search_engine.searched == ['a', 'b', 'c']
+    assert cached_engine.hits == 0
+    assert cached_engine.misses == 9
+
+    cached_engine.search_many(['a', 'b'], size=1)
+    assert cached_engine.hits == 2
+    assert cached_engine.misses == 9
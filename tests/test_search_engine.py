@@ -0,0 +1,123 @@
+import pytest
+
+from es_standin import StandInError
+from es_standin import InMemoryElasticsearch
+from recall_cache import RecallCache
+from recall_cache import CachedSearchEngine
+from search_engine import SearchError
+from search_engine import DiseaseSearchEngine
+from search_engine import retry_failed_search
+
+BAD_QUERY = '__bad_query__'
+
+
+class FaultyElasticsearch(InMemoryElasticsearch):
+    # BAD_QUERY换成替身不支持的查询，得到该条的错误响应；fail_requests为True时_msearch和search请求都失败
+
+    def __init__(self, **kwargs):
+        super(FaultyElasticsearch, self).__init__(**kwargs)
+        self.fail_requests = False
+
+    def search(self, index=None, body=None, size=None, **kwargs):
+        if self.fail_requests:
+            raise StandInError(503, 'unavailable_shards_exception', 'standin is down')
+        return super(FaultyElasticsearch, self).search(index=index, body=body, size=size, **kwargs)
+
+    def msearch(self, body, index=None, **kwargs):
+        if self.fail_requests:
+            raise StandInError(503, 'unavailable_shards_exception', 'standin is down')
+
+        body = [
+            {'query': {'term': {'surface_name': BAD_QUERY}}}
+            if 'query' in line_ and line_['query']['match']['surface_name']['query'] == BAD_QUERY else line_
+            for line_ in body
+        ]
+        return super(FaultyElasticsearch, self).msearch(body, index=index, **kwargs)
+
+
+def build_standin(names, **kwargs):
+    es = FaultyElasticsearch(**kwargs)
+    actions = []
+    for doc_id, name_ in enumerate(names):
+        actions.append({'index': {'_index': 'icd_diagnose', '_id': str(doc_id)}})
+        actions.append({'surface_name': name_, 'entity_name': name_})
+    es.bulk(actions)
+    return es
+
+
+# 每个名称只有自己的编号能匹配，top1可以确定结果对应哪个query
+NAMES = ['病例{0}'.format(idx) for idx in range(23)]
+
+
+@pytest.mark.parametrize('msearch_workers', [1, 4])
+def test_search_many_keeps_input_order_across_chunks(msearch_workers):
+    # 请求有随机延迟，并发时各_msearch请求的完成顺序与发送顺序不同
+    es = build_standin(NAMES, latency=0.001, jitter=0.01, seed=0)
+    search_engine = DiseaseSearchEngine(es=es, msearch_workers=msearch_workers)
+
+    queries = list(reversed(NAMES))
+    results = search_engine.search_many(queries, size=1, chunk_size=4)
+
+    assert es.request_num == 1 + 6
+    assert [result_['hits']['hits'][0]['_source']['entity_name'] for result_ in results] == queries
+
+
+def test_search_many_isolates_bad_query():
+    search_engine = DiseaseSearchEngine(es=build_standin(NAMES))
+
+    queries = NAMES[:5] + [BAD_QUERY] + NAMES[5:9]
+    results = search_engine.search_many(queries, size=1, chunk_size=4)
+
+    assert len(results) == len(queries)
+    assert 'error' in results[5]
+    assert results[5]['hits']['hits'] == []
+    for query_, result_ in zip(queries, results):
+        if query_ != BAD_QUERY:
+            assert 'error' not in result_
+            assert result_['hits']['hits'][0]['_source']['entity_name'] == query_
+
+
+def test_search_many_returns_error_results_when_request_fails():
+    es = build_standin(NAMES)
+    es.fail_requests = True
+    search_engine = DiseaseSearchEngine(es=es)
+
+    results = search_engine.search_many(NAMES[:6], size=1, chunk_size=4)
+
+    assert len(results) == 6
+    assert all('error' in result_ and result_['hits']['hits'] == [] for result_ in results)
+
+
+def test_retry_failed_search_recovers_after_transient_failure():
+    # 与predict.py相同的路径: 批量召回得到错误占位结果，单独重试
+    es = build_standin(NAMES)
+    search_engine = DiseaseSearchEngine(es=es)
+
+    es.fail_requests = True
+    search_result = search_engine.search_many(NAMES[:1], size=1)[0]
+    assert 'error' in search_result
+
+    es.fail_requests = False
+    search_result = retry_failed_search(search_engine, NAMES[0], 1, search_result)
+    assert search_result['hits']['hits'][0]['_source']['entity_name'] == NAMES[0]
+
+
+def test_retry_failed_search_keeps_good_results():
+    es = build_standin(NAMES)
+    search_engine = DiseaseSearchEngine(es=es)
+
+    search_result = search_engine.search_many(NAMES[:1], size=1)[0]
+    request_num = es.request_num
+    assert retry_failed_search(search_engine, NAMES[0], 1, search_result) is search_result
+    assert es.request_num == request_num
+
+
+def test_retry_failed_search_raises_when_retry_fails():
+    es = build_standin(NAMES)
+    es.fail_requests = True
+    # 缓存层把失败转成错误占位结果而不是抛出异常，重试后仍然出错要抛出SearchError
+    search_engine = CachedSearchEngine(DiseaseSearchEngine(es=es), cache=RecallCache(':memory:'), index_version='test')
+
+    search_result = search_engine.search_many(NAMES[:1], size=1)[0]
+    with pytest.raises(SearchError):
+        retry_failed_search(search_engine, NAMES[0], 1, search_result)
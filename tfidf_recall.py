@@ -0,0 +1,86 @@
+import numpy as np
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# search_many每次做一次稀疏矩阵乘法的query数，控制[chunk, 文档数]结果矩阵的内存
+TFIDF_CHUNK_SIZE = 1000
+
+
+class TfidfSearchEngine(object):
+    # 字符n-gram的TF-IDF召回，适合离线批量任务: 一批query只做一次稀疏矩阵乘法
+    # 返回与DiseaseSearchEngine.search相同结构的结果，_score为余弦相似度
+
+    def __init__(
+        self,
+        records,
+        field='surface_name',
+        ngram_range=(1, 3),
+        index_name='tfidf'
+    ):
+        self.records = records
+        self.field = field
+        self.index_name = index_name
+
+        self.vectorizer = TfidfVectorizer(
+            analyzer='char',
+            ngram_range=ngram_range,
+            lowercase=True,
+            sublinear_tf=True,
+            dtype=np.float32)
+        # 行已经L2归一化，与query向量的内积即余弦相似度
+        self.doc_matrix = self.vectorizer.fit_transform(
+            [str(record_[field]) for record_ in records]).T.tocsr()
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_index_version(self):
+        return self.index_name
+
+    def _get_result(self, scores, doc_ids, size):
+        total = len(doc_ids)
+        if total > size:
+            # 先保留所有不低于第size名分数的文档，再排序截断，分数相同时按写入顺序
+            threshold = np.partition(scores, total - size)[total - size]
+            keep = scores >= threshold
+            scores = scores[keep]
+            doc_ids = doc_ids[keep]
+        order = np.lexsort((doc_ids, -scores))[:size]
+
+        hits = []
+        for score_, doc_id in zip(scores[order].tolist(), doc_ids[order].tolist()):
+            hits.append({
+                '_index': self.index_name,
+                '_id': str(doc_id),
+                '_score': score_,
+                '_source': self.records[doc_id]
+            })
+
+        return {
+            'hits': {
+                'total': {'value': total, 'relation': 'eq'},
+                'max_score': hits[0]['_score'] if len(hits) > 0 else None,
+                'hits': hits
+            }
+        }
+
+    def iter_search_many(self, queries, size=20, chunk_size=TFIDF_CHUNK_SIZE):
+        queries = list(queries)
+        for start in range(0, len(queries), chunk_size):
+            scores = (self.vectorizer.transform(queries[start:start + chunk_size]) @ self.doc_matrix).tocsr()
+            scores.eliminate_zeros()
+            for row_ in range(scores.shape[0]):
+                row_slice = slice(scores.indptr[row_], scores.indptr[row_ + 1])
+                yield self._get_result(scores.data[row_slice], scores.indices[row_slice], size)
+
+    def search_many(self, queries, size=20, chunk_size=TFIDF_CHUNK_SIZE):
+        return list(self.iter_search_many(queries, size=size, chunk_size=chunk_size))
+
+    def search(self, _query: str, size=20):
+        return self.search_many([_query], size)[0]
+
+
+def build_tfidf_search_engine(train_path='./train.txt', workers=None):
+    from icd_catalog import build_catalog_search_engine
+
+    return build_catalog_search_engine(TfidfSearchEngine, 'tfidf', train_path, workers=workers)
@@ -0,0 +1,558 @@
+import os
+import sys
+import mmap
+import pickle
+import struct
+import hashlib
+import heapq
+import threading
+
+from array import array
+from collections import Counter
+
+SNAPSHOT_MAGIC = b'ACTRIE\x00\x00'
+SNAPSHOT_VERSION = 1
+# magic, version, 槽位数, 关键词数, 字符表字节数, 关键词字节数, values字节数, 关键词摘要
+SNAPSHOT_HEADER = struct.Struct('<8sIIIIII32s')
+SNAPSHOT_ALIGN = mmap.PAGESIZE
+SNAPSHOT_ARRAYS = ['base', 'check', 'fail', 'output', 'word_id', 'depth']
+
+MATCH_ALL = 'all'
+MATCH_LEFTMOST_LONGEST = 'leftmost_longest'
+MATCH_NON_OVERLAPPING = 'non_overlapping'
+
+
+def keywords_digest(words):
+    sha256 = hashlib.sha256()
+    for keyword in sorted(words):
+        sha256.update(keyword.encode('utf-8'))
+        sha256.update(b'\x00')
+    return sha256.digest()
+
+
+class Match(object):
+
+    def __init__(self, start, end, keyword):
+        self.start = start
+        self.end = end
+        self.keyword = keyword
+
+    def __str__(self):
+        return "{0}:{1}={2}".format(self.start, self.end, self.keyword)
+
+    __repr__ = __str__
+
+
+def select_matches(matchs, mode=MATCH_ALL):
+    # matchs需按结束位置从左到右、同一结束位置先长后短排列(即iter_matches的顺序)
+    # all: 所有匹配(包括嵌套的子串)
+    # leftmost_longest: 从左到右取起点最靠左的匹配，起点相同取最长，结果互不重叠
+    # non_overlapping: 扫描时遇到的第一个(结束位置最靠左、其中最长)与已选结果不重叠的匹配
+    if mode == MATCH_ALL:
+        return list(matchs)
+
+    if mode == MATCH_NON_OVERLAPPING:
+        selected = []
+        last_end = 0
+        for m in matchs:
+            if m.start >= last_end:
+                selected.append(m)
+                last_end = m.end
+        return selected
+
+    if mode == MATCH_LEFTMOST_LONGEST:
+        selected = []
+        last_end = 0
+        for m in sorted(matchs, key=lambda x: (x.start, x.start - x.end)):
+            if m.start >= last_end:
+                selected.append(m)
+                last_end = m.end
+        return selected
+
+    raise ValueError('unknown match mode: ' + str(mode))
+
+
+class Trie(object):
+    # 双数组(base/check)存储的AC自动机
+    # 节点编号就是在base/check中的下标，根节点为0
+    # 节点s经字符编号c转移到t = base[s] + c，当且仅当check[t] == s
+    # fail为失败指针，output指向失败链上最近的终止节点(没有为-1)，word_id为节点对应关键词的编号(非终止为-1)
+    # 字符编号从1开始按出现频次分配，0表示词表外字符
+
+    FREE = -1
+
+    def __init__(self, words=None):
+
+        self.char_ids = dict()
+        self.keywords = []
+        self.values = []
+        self._keyword_ids = dict()
+
+        self.base = array('i', [0])
+        self.check = array('i', [-2])
+        self.fail = array('i', [0])
+        self.output = array('i', [-1])
+        self.word_id = array('i', [-1])
+        self.depth = array('i', [0])
+
+        self.is_create_failure = False
+        if words:
+            self.create_trie(words)
+
+    def create_trie(self, words):
+        if isinstance(words, (list, set)):
+            for keyword in words:
+                self.add_keyword(keyword, '')
+            self.create_failure()
+        elif isinstance(words, dict):
+            for keyword, value in words.items():
+                self.add_keyword(keyword, value)
+            self.create_failure()
+        else:
+            raise ValueError('错误的数据类型')
+
+    def add_keyword(self, keyword, value):
+        if keyword in self._keyword_ids:
+            self.values[self._keyword_ids[keyword]] = value
+            return
+
+        self._keyword_ids[keyword] = len(self.keywords)
+        self.keywords.append(keyword)
+        self.values.append(value)
+        self.is_create_failure = False
+
+    def create_failure(self):
+        char_counter = Counter()
+        for keyword in self.keywords:
+            char_counter.update(keyword)
+        self.char_ids = {ch: idx + 1 for idx, (ch, _) in enumerate(char_counter.most_common())}
+
+        # 1. 先用临时的dict字典树组织关键词
+        children = [dict()]
+        node_word_id = [-1]
+        node_depth = [0]
+        for word_id, keyword in enumerate(self.keywords):
+            if keyword == '':
+                continue
+            node = 0
+            for ch in keyword:
+                c = self.char_ids[ch]
+                next_node = children[node].get(c)
+                if next_node is None:
+                    next_node = len(children)
+                    children[node][c] = next_node
+                    children.append(dict())
+                    node_word_id.append(-1)
+                    node_depth.append(node_depth[node] + 1)
+                node = next_node
+            node_word_id[node] = word_id
+
+        # 2. BFS计算失败指针
+        bfs_order = [0]
+        node_fail = [0] * len(children)
+        for node in bfs_order:
+            for c, child in children[node].items():
+                bfs_order.append(child)
+                if node == 0:
+                    continue
+                trace = node_fail[node]
+                while c not in children[trace] and trace != 0:
+                    trace = node_fail[trace]
+                node_fail[child] = children[trace].get(c, 0)
+
+        # 3. 按BFS顺序把节点放进双数组
+        position = self._place_nodes(children, bfs_order)
+
+        size = len(self.check)
+        self.fail = array('i', [0]) * size
+        self.output = array('i', [-1]) * size
+        self.word_id = array('i', [-1]) * size
+        self.depth = array('i', [0]) * size
+        for node in bfs_order:
+            pos = position[node]
+            fail_pos = position[node_fail[node]]
+            self.fail[pos] = fail_pos
+            self.word_id[pos] = node_word_id[node]
+            self.depth[pos] = node_depth[node]
+            if node != 0:
+                self.output[pos] = fail_pos if self.word_id[fail_pos] >= 0 else self.output[fail_pos]
+
+        self.is_create_failure = True
+
+    def _place_nodes(self, children, bfs_order):
+        max_char_id = len(self.char_ids)
+        position = [0] * len(children)
+
+        base = array('i', [0])
+        check = array('i', [-2])
+        used = bytearray(b'\x01')
+
+        def grow(size):
+            if size > len(check):
+                extra = size - len(check)
+                base.extend(array('i', [0]) * extra)
+                check.extend(array('i', [self.FREE]) * extra)
+                used.extend(bytes(extra))
+
+        next_free = 1
+        for node in bfs_order:
+            chars = sorted(children[node])
+            if not chars:
+                continue
+
+            first_char = chars[0]
+            pos = used.find(0, max(next_free, first_char))
+            while True:
+                if pos == -1:
+                    pos = max(len(used), first_char)
+                grow(pos - first_char + chars[-1] + 1)
+                node_base = pos - first_char
+                # 大部分节点只有一个子节点，找到空位即可
+                if len(chars) == 1 or all(used[node_base + c] == 0 for c in chars):
+                    break
+                pos = used.find(0, pos + 1)
+
+            pos_ = position[node]
+            base[pos_] = node_base
+            for c in chars:
+                child_pos = node_base + c
+                used[child_pos] = 1
+                check[child_pos] = pos_
+                position[children[node][c]] = child_pos
+
+            next_free = used.find(0, next_free)
+            if next_free == -1:
+                next_free = len(used)
+
+        # 末尾补齐max_char_id个空位，查转移时不用判断越界
+        grow(len(check) + max_char_id + 1)
+
+        self.base = base
+        self.check = check
+
+        return position
+
+    def get_state(self, current_state, word):
+        c = self.char_ids.get(word, 0)
+        base = self.base
+        check = self.check
+        fail = self.fail
+
+        while True:
+            if c:
+                next_state = base[current_state] + c
+                if check[next_state] == current_state:
+                    return next_state
+            if current_state == 0:
+                return None
+            current_state = fail[current_state]
+
+    def iter_matches(self, text):
+        # 按结束位置从左到右产出所有匹配，同一结束位置先长后短
+        if not self.is_create_failure:
+            self.create_failure()
+
+        char_ids = self.char_ids
+        base = self.base
+        check = self.check
+        fail = self.fail
+        output = self.output
+        word_id = self.word_id
+        keywords = self.keywords
+
+        current_state = 0
+        for position, word in enumerate(text, 1):
+            c = char_ids.get(word, 0)
+            if not c:
+                current_state = 0
+                continue
+
+            next_state = base[current_state] + c
+            while check[next_state] != current_state:
+                if current_state == 0:
+                    next_state = -1
+                    break
+                current_state = fail[current_state]
+                next_state = base[current_state] + c
+            if next_state == -1:
+                current_state = 0
+                continue
+            current_state = next_state
+
+            emit_state = current_state if word_id[current_state] >= 0 else output[current_state]
+            while emit_state > 0:
+                keyword = keywords[word_id[emit_state]]
+                yield Match(position - len(keyword), position, keyword)
+                emit_state = output[emit_state]
+
+    def match_spans(self, text, mode=MATCH_ALL):
+        return select_matches(self.iter_matches(text), mode)
+
+    def match(self, text, allow_over_laps=True, mode=None):
+        if mode is None:
+            mode = MATCH_ALL if allow_over_laps else MATCH_NON_OVERLAPPING
+        if mode != MATCH_ALL:
+            return [m.keyword for m in self.match_spans(text, mode)]
+
+        matchs = []
+        if not self.is_create_failure:
+            self.create_failure()
+
+        char_ids = self.char_ids
+        base = self.base
+        check = self.check
+        fail = self.fail
+        output = self.output
+        word_id = self.word_id
+        keywords = self.keywords
+
+        current_state = 0
+        for word in text:
+            c = char_ids.get(word, 0)
+            if not c:
+                current_state = 0
+                continue
+
+            next_state = base[current_state] + c
+            while check[next_state] != current_state:
+                if current_state == 0:
+                    next_state = -1
+                    break
+                current_state = fail[current_state]
+                next_state = base[current_state] + c
+            if next_state == -1:
+                current_state = 0
+                continue
+            current_state = next_state
+
+            emit_state = current_state if word_id[current_state] >= 0 else output[current_state]
+            while emit_state > 0:
+                matchs.append(keywords[word_id[emit_state]])
+                emit_state = output[emit_state]
+        return matchs
+
+    def save(self, snapshot_path):
+        # 快照布局: 头部 | 按页对齐的int32数组(base check fail output word_id depth) | 字符表 | 关键词 | values
+        if not self.is_create_failure:
+            self.create_failure()
+
+        alphabet = ''.join(sorted(self.char_ids, key=self.char_ids.get)).encode('utf-8')
+        keyword_bytes = [keyword.encode('utf-8') for keyword in self.keywords]
+        keyword_offsets = array('i', [0])
+        for keyword_ in keyword_bytes:
+            keyword_offsets.append(keyword_offsets[-1] + len(keyword_))
+        keyword_blob = keyword_offsets.tobytes() + b''.join(keyword_bytes)
+        values_blob = pickle.dumps(self.values, protocol=pickle.HIGHEST_PROTOCOL)
+
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            len(self.check),
+            len(self.keywords),
+            len(alphabet),
+            len(keyword_blob),
+            len(values_blob),
+            keywords_digest(self.keywords)
+        )
+
+        tmp_path = snapshot_path + '.tmp' + str(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(bytes(SNAPSHOT_ALIGN - len(header)))
+            for array_name in SNAPSHOT_ARRAYS:
+                f.write(array('i', getattr(self, array_name)).tobytes())
+            f.write(alphabet)
+            f.write(keyword_blob)
+            f.write(values_blob)
+        os.replace(tmp_path, snapshot_path)
+
+    @staticmethod
+    def read_snapshot_digest(snapshot_path):
+        with open(snapshot_path, 'rb') as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+        if len(header) != SNAPSHOT_HEADER.size:
+            return None
+        magic, version, _, _, _, _, _, digest = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None
+        return digest
+
+    @classmethod
+    def load(cls, snapshot_path):
+        # 数组部分直接mmap只读映射，同一台机器上的多个进程共享同一份物理页
+        if sys.byteorder != 'little':
+            raise ValueError('trie snapshot is little-endian only')
+
+        with open(snapshot_path, 'rb') as f:
+            snapshot_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, slot_num, keyword_num,
+         alphabet_size, keyword_blob_size, values_size, _) = SNAPSHOT_HEADER.unpack_from(snapshot_mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('not a trie snapshot: ' + snapshot_path)
+
+        trie = cls()
+        snapshot_view = memoryview(snapshot_mmap)
+        offset = SNAPSHOT_ALIGN
+        for array_name in SNAPSHOT_ARRAYS:
+            setattr(trie, array_name, snapshot_view[offset:offset + slot_num * 4].cast('i'))
+            offset += slot_num * 4
+
+        alphabet = bytes(snapshot_view[offset:offset + alphabet_size]).decode('utf-8')
+        trie.char_ids = {ch: idx + 1 for idx, ch in enumerate(alphabet)}
+        offset += alphabet_size
+
+        keyword_offsets = snapshot_view[offset:offset + (keyword_num + 1) * 4].cast('i')
+        keyword_data = bytes(snapshot_view[offset + (keyword_num + 1) * 4:offset + keyword_blob_size])
+        trie.keywords = [keyword_data[keyword_offsets[idx]:keyword_offsets[idx + 1]].decode('utf-8')
+                         for idx in range(keyword_num)]
+        offset += keyword_blob_size
+
+        trie.values = pickle.loads(snapshot_view[offset:offset + values_size])
+        trie._keyword_ids = {keyword: idx for idx, keyword in enumerate(trie.keywords)}
+        trie._snapshot_mmap = snapshot_mmap
+        trie.is_create_failure = True
+
+        return trie
+
+
+def load_or_build_trie(words, snapshot_path):
+    # 快照头部记录了关键词集合的摘要，ICD目录变化后摘要不一致，自动重建并覆盖快照
+    if os.path.exists(snapshot_path):
+        try:
+            if Trie.read_snapshot_digest(snapshot_path) == keywords_digest(words):
+                return Trie.load(snapshot_path)
+        except (ValueError, struct.error, UnicodeDecodeError, pickle.UnpicklingError):
+            pass
+
+    trie = Trie(words)
+    snapshot_dir = os.path.dirname(snapshot_path)
+    if snapshot_dir:
+        os.makedirs(snapshot_dir, exist_ok=True)
+    trie.save(snapshot_path)
+
+    return trie
+
+
+class IncrementalTrie(object):
+    # 在运行中的自动机上增删关键词，不用重启
+    # 新增的词放进一个小的增量自动机(每次增删直接重建，词少所以很快)，删除的词记在removed里过滤掉
+    # 增量超过merge_threshold时在后台线程把增量合并进主自动机，合并期间的增删操作合并完成后重放
+
+    def __init__(self, trie, merge_threshold=1000, snapshot_path=None):
+        self.merge_threshold = merge_threshold
+        self.snapshot_path = snapshot_path
+
+        self._lock = threading.RLock()
+        # (主自动机, 增量自动机, 增量词, 删除的词)，整体替换，读的时候不需要加锁
+        self._state = (trie, None, dict(), frozenset())
+        self._pending_ops = None
+        self._merge_thread = None
+
+    @property
+    def main_trie(self):
+        return self._state[0]
+
+    def __contains__(self, keyword):
+        trie, _, delta_words, removed = self._state
+        return keyword in delta_words or (keyword in trie._keyword_ids and keyword not in removed)
+
+    def _apply(self, state, op, keyword, value):
+        trie, delta, delta_words, removed = state
+        removed = set(removed)
+
+        if op == 'add':
+            if keyword in trie._keyword_ids:
+                removed.discard(keyword)
+            elif delta_words.get(keyword, None) != value or keyword not in delta_words:
+                delta_words = dict(delta_words)
+                delta_words[keyword] = value
+                delta = Trie(delta_words)
+        else:
+            if keyword in delta_words:
+                delta_words = dict(delta_words)
+                del delta_words[keyword]
+                delta = Trie(delta_words) if delta_words else None
+            if keyword in trie._keyword_ids:
+                removed.add(keyword)
+
+        return (trie, delta, delta_words, frozenset(removed))
+
+    def _update(self, op, keyword, value=''):
+        with self._lock:
+            self._state = self._apply(self._state, op, keyword, value)
+            if self._pending_ops is not None:
+                self._pending_ops.append((op, keyword, value))
+            elif len(self._state[2]) + len(self._state[3]) >= self.merge_threshold:
+                self.merge(background=True)
+
+    def add_keyword(self, keyword, value=''):
+        self._update('add', keyword, value)
+
+    def remove_keyword(self, keyword):
+        self._update('remove', keyword)
+
+    def add_keywords(self, keywords):
+        for keyword in keywords:
+            self.add_keyword(keyword)
+
+    def remove_keywords(self, keywords):
+        for keyword in keywords:
+            self.remove_keyword(keyword)
+
+    def merge(self, background=False):
+        with self._lock:
+            if self._pending_ops is not None:
+                return self._merge_thread
+            self._pending_ops = []
+            state = self._state
+
+        if not background:
+            self._merge(state)
+            return None
+
+        self._merge_thread = threading.Thread(target=self._merge, args=(state,), daemon=True)
+        self._merge_thread.start()
+        return self._merge_thread
+
+    def _merge(self, state):
+        trie, _, delta_words, removed = state
+        try:
+            words = {keyword: value for keyword, value in zip(trie.keywords, trie.values)
+                     if keyword not in removed}
+            words.update(delta_words)
+
+            merged_trie = Trie(words) if words else Trie()
+            if self.snapshot_path is not None:
+                merged_trie.save(self.snapshot_path)
+
+            with self._lock:
+                new_state = (merged_trie, None, dict(), frozenset())
+                for op, keyword, value in self._pending_ops:
+                    new_state = self._apply(new_state, op, keyword, value)
+                self._state = new_state
+        finally:
+            with self._lock:
+                self._pending_ops = None
+
+    def iter_matches(self, text):
+        trie, delta, _, removed = self._state
+
+        matchs = trie.iter_matches(text)
+        if removed:
+            matchs = (m for m in matchs if m.keyword not in removed)
+        if delta is not None:
+            matchs = heapq.merge(matchs, delta.iter_matches(text), key=lambda m: (m.end, m.start))
+        return matchs
+
+    def match_spans(self, text, mode=MATCH_ALL):
+        return select_matches(self.iter_matches(text), mode)
+
+    def match(self, text, allow_over_laps=True, mode=None):
+        trie, delta, _, removed = self._state
+        if delta is None and not removed:
+            return trie.match(text, allow_over_laps, mode)
+
+        if mode is None:
+            mode = MATCH_ALL if allow_over_laps else MATCH_NON_OVERLAPPING
+        return [m.keyword for m in self.match_spans(text, mode)]